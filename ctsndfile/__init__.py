@@ -1 +1,9 @@
-__all__ = ["libsndfile"]
+import sys
+
+__all__ = ["libsndfile", "batch", "seekindex", "sampler", "cache", "probe",
+           "benchmark", "instrument", "prefetch", "writer", "transcode",
+           "overview", "fileset", "resample"]
+
+# asyncio doesn't exist on Python 2
+if sys.version_info >= (3, 4):
+    __all__.append("aio")
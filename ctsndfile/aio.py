@@ -0,0 +1,283 @@
+"""
+asyncio front end of SndFile (requires Python 3 and its asyncio).
+
+Every libsndfile call runs on a bounded thread pool so the event loop is
+never blocked while a file is opened, decoded or encoded, and the number of
+files open at once is limited so thousands of concurrent requests can't
+exhaust the file descriptors:
+
+    f = await AsyncSndFile.open("speech.flac")
+    async with f:
+        data, nbFramesRead = await f.read_from_to(0, 16000)
+        async for block in f.blocks(4096):
+            ...
+
+It's only listed in ctsndfile's __all__ on Python 3, asyncio doesn't exist
+on Python 2.
+"""
+
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from ctsndfile.libsndfile import SndFile, OPEN_MODES, FILE_FORMATS, SEEK_MODES
+
+_END = object()
+
+
+class _OpenLimit(object):
+    """ class internal, counts the files open and hands the free slots to the
+    waiting futures, possibly from several event loops """
+
+    def __init__(self, value):
+        self._value = value
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self, loop):
+        """ returns a future done once a slot is taken """
+        future = loop.create_future()
+        with self._lock:
+            if self._value > 0:
+                self._value -= 1
+                future.set_result(None)
+            else:
+                self._waiters.append(future)
+        return future
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                future = self._waiters.popleft()
+                if not future.done():
+                    future.get_loop().call_soon_threadsafe(self._grant, future)
+                    return
+            self._value += 1
+
+    def _grant(self, future):
+        if future.done():
+            # cancelled while the slot was handed over
+            self.release()
+        else:
+            future.set_result(None)
+
+
+def _chain(loop, future, function):
+    """ returns a future of function(result of future) """
+    chained = loop.create_future()
+    def done(future):
+        if chained.done():
+            return
+        if future.cancelled():
+            chained.cancel()
+        elif future.exception() is not None:
+            chained.set_exception(future.exception())
+        else:
+            try:
+                chained.set_result(function(future.result()))
+            except Exception as e:
+                chained.set_exception(e)
+    future.add_done_callback(done)
+    return chained
+
+
+class AsyncSndFile(object):
+    """ a SndFile whose methods return awaitables, open it with
+    AsyncSndFile.open. The calls on one file are run one at a time, each one
+    submitted to the shared executor once the previous one is done, so calls
+    waiting for a busy file don't hold workers. The calls on different files
+    run concurrently. """
+
+    # shared by all the instances, the executor is created on first use
+    executor = None
+    max_workers = 8
+    max_open = 256
+    _executor_lock = threading.Lock()
+    _limit = None
+
+    def __init__(self, sndfile, loop=None):
+        """ wraps an open sndfile. Only the files opened with open count as
+        one of the max_open files, until closed """
+        self.sndfile = sndfile
+        self._loop = loop
+        # whether this file holds one of the max_open slots, set by open
+        self._slot = False
+        # done once the last call submitted is finished
+        self._tail = None
+        self._closed = False
+
+    @classmethod
+    def _shared(cls):
+        """ class internal, returns the executor and the open files limit,
+        created on first use from max_workers and max_open """
+        with cls._executor_lock:
+            if cls.executor is None:
+                cls.executor = ThreadPoolExecutor(cls.max_workers)
+            if AsyncSndFile._limit is None:
+                AsyncSndFile._limit = _OpenLimit(cls.max_open)
+            return cls.executor, AsyncSndFile._limit
+
+    @classmethod
+    def open(cls, file_, open_mode=OPEN_MODES.SFM_READ,
+             writeSamplerate=48000,
+             writeFormat=FILE_FORMATS.SF_FORMAT_WAV^FILE_FORMATS.SF_FORMAT_PCM_16,
+             writeNbChannels=2):
+        """ returns an awaitable of an AsyncSndFile opened as SndFile would,
+        waiting first for one of the max_open files to be closed if needed """
+        loop = asyncio.get_event_loop()
+        executor, limit = cls._shared()
+        opened = loop.create_future()
+
+        def acquired(future):
+            if future.cancelled():
+                opened.cancel()
+                return
+            if opened.done():
+                limit.release()
+                return
+            job = loop.run_in_executor(executor, partial(
+                SndFile, file_, open_mode, writeSamplerate, writeFormat, writeNbChannels))
+            job.add_done_callback(done)
+
+        def done(job):
+            if job.exception() is not None:
+                limit.release()
+                if not opened.done():
+                    opened.set_exception(job.exception())
+            elif opened.done():
+                # cancelled while opening
+                job.result().close()
+                limit.release()
+            else:
+                asyncfile = cls(job.result(), loop)
+                asyncfile._slot = True
+                opened.set_result(asyncfile)
+
+        limit.acquire(loop).add_done_callback(acquired)
+        return opened
+
+    def _run(self, function, *args):
+        """ class internal, returns a future of function(*args) run on the
+        executor after the previous calls on this file """
+        if self._closed:
+            raise Exception("I/O operation on a closed file")
+        return self._submit(partial(function, *args), True)
+
+    def _submit(self, call, cancellable):
+        """ class internal, chains call after the last call on this file. The
+        chain is kept on the event loop, call is only given to the executor
+        when it can run. call is skipped if cancellable and its future was
+        cancelled meanwhile. """
+        loop = self._loop or asyncio.get_event_loop()
+        executor = self._shared()[0]
+        result = loop.create_future()
+        finished = loop.create_future()
+        previous, self._tail = self._tail, finished
+
+        def start(previous=None):
+            if cancellable and result.cancelled():
+                finished.set_result(None)
+                return
+            loop.run_in_executor(executor, call).add_done_callback(done)
+
+        def done(job):
+            finished.set_result(None)
+            if result.cancelled():
+                return
+            if job.exception() is not None:
+                result.set_exception(job.exception())
+            else:
+                result.set_result(job.result())
+
+        if previous is None or previous.done():
+            start()
+        else:
+            previous.add_done_callback(start)
+        return result
+
+    @property
+    def nbFrames(self):
+        return self.sndfile.nbFrames
+    @property
+    def samplerate(self):
+        return self.sndfile.samplerate
+    @property
+    def format(self):
+        return self.sndfile.format
+    @property
+    def channels(self):
+        return self.sndfile.channels
+
+    def read(self, nbFrames=None, dtype=np.float32, out=None, channels=None, mix=None):
+        """ awaitable of SndFile.read """
+        return self._run(self.sndfile.read, nbFrames, dtype, out, channels, mix)
+
+    def read_from_to(self, startFrame, stopFrame, dtype=np.float32, out=None,
+                     channels=None, mix=None):
+        """ awaitable of SndFile.readFromTo """
+        return self._run(self.sndfile.readFromTo, startFrame, stopFrame, dtype, out,
+                         channels, mix)
+
+    def readinto(self, buf, dtype=np.float32):
+        """ awaitable of SndFile.readinto """
+        return self._run(self.sndfile.readinto, buf, dtype)
+
+    def write(self, data):
+        """ awaitable of SndFile.write, data must not be modified until it's done """
+        return self._run(self.sndfile.write, data)
+
+    def seek(self, frame_position, whence=SEEK_MODES.SEEK_SET):
+        """ awaitable of SndFile.seek """
+        return self._run(self.sndfile.seek, frame_position, whence)
+
+    def blocks(self, blocksize, overlap=0, dtype=np.float32, out=None, pad=False,
+               channels=None, mix=None):
+        """ asynchronous iterator of SndFile.blocks, the blocks are views of a
+        single buffer overwritten by the next iteration """
+        return _AsyncBlocks(self, self.sndfile.blocks(blocksize, overlap, dtype, out, pad,
+                                                      channels, mix))
+
+    def close(self):
+        """ awaitable closing the file, which frees its slot of max_open if
+        it was opened with open """
+        if self._closed:
+            future = (self._loop or asyncio.get_event_loop()).create_future()
+            future.set_result(None)
+            return future
+        closing = self._submit(self.sndfile.close, False)
+        self._closed = True
+        if self._slot:
+            # once closed, even if the caller stopped waiting
+            self._tail.add_done_callback(lambda finished: self._shared()[1].release())
+        return closing
+
+    def __aenter__(self):
+        future = (self._loop or asyncio.get_event_loop()).create_future()
+        future.set_result(self)
+        return future
+
+    def __aexit__(self, type, value, traceback):
+        return self.close()
+
+
+class _AsyncBlocks(object):
+    """ class internal, asynchronous iterator over a blocks generator """
+
+    def __init__(self, asyncfile, blocks):
+        self._file = asyncfile
+        self._blocks = blocks
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        loop = self._file._loop or asyncio.get_event_loop()
+        def block(block):
+            if block is _END:
+                raise StopAsyncIteration
+            return block
+        return _chain(loop, self._file._run(next, self._blocks, _END), block)
@@ -0,0 +1,102 @@
+"""
+Concurrent decoding of many audio files.
+
+libsndfile calls made through ctypes release the GIL, so decoding on a pool
+of threads scales across cores without the cost of multiprocessing.
+"""
+
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from ctsndfile.libsndfile import SndFile
+from ctsndfile.resample import NormalizedSndFile
+
+
+ReadResult = namedtuple("ReadResult", ["index", "path", "data", "nbFramesRead", "error"])
+
+
+def _read_one(args):
+    index, path, dtype, nbFrames, samplerate, channels = args
+    try:
+        f = SndFile(path)
+        try:
+            if samplerate is None and channels is None:
+                data, nbFramesRead = f.read(nbFrames, dtype)
+            else:
+                data, nbFramesRead = NormalizedSndFile(f, samplerate, channels,
+                                                       dtype).read(nbFrames)
+        finally:
+            f.close()
+    except Exception as e:
+        return ReadResult(index, path, None, 0, e)
+    return ReadResult(index, path, data, nbFramesRead, None)
+
+
+def read_many(paths, dtype=np.float32, frames=None, max_workers=None, ordered=True,
+              samplerate=None, channels=None):
+    """ decodes the files in paths on a pool of max_workers threads (one per
+    cpu by default) and yields a ReadResult for each of them, in the order of
+    paths if ordered is True, else as they complete.
+    Reads frames frames of each file (zero padded) if provided, else the
+    entire files. index is the position of the file in paths and error the
+    exception raised while opening or reading it (data is then None), errors
+    don't stop the batch. If samplerate or channels are given, the files are
+    resampled and mixed to them (see NormalizedSndFile), frames counting
+    frames at samplerate."""
+    pool = ThreadPool(max_workers)
+    try:
+        jobs = [(index, path, dtype, frames, samplerate, channels)
+                for index, path in enumerate(paths)]
+        imap = pool.imap if ordered else pool.imap_unordered
+        for result in imap(_read_one, jobs):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def read_padded(paths, frames, channels=1, dtype=np.float32, max_workers=None, out=None,
+                samplerate=None):
+    """ decodes the first frames frames of each file in paths concurrently into
+    one array of shape (len(paths), frames, channels), zero padded, which is
+    allocated once or given as out. Returns the array, a vector of the number
+    of frames read for each file and a dict mapping the index of each file that
+    failed (or that doesn't have channels channels) to its exception.
+    If samplerate is given, the files are resampled to it and mixed to
+    channels channels (see NormalizedSndFile) instead."""
+    paths = list(paths)
+    if out is None:
+        out = np.zeros((len(paths), frames, channels), np.dtype(dtype).type)
+    elif out.shape != (len(paths), frames, channels) or not out.flags.c_contiguous:
+        raise Exception("out must be a C-contiguous array of shape (%d, %d, %d)"
+                        % (len(paths), frames, channels))
+    lengths = np.zeros(len(paths), np.int64)
+    errors = {}
+
+    def read_into(index):
+        try:
+            f = SndFile(paths[index])
+            try:
+                if samplerate is not None:
+                    normalized = NormalizedSndFile(f, samplerate, channels, out.dtype)
+                    lengths[index] = normalized.read(frames, out=out[index])[1]
+                elif f.channels != channels:
+                    raise Exception("%s has %d channels, expected %d"
+                                    % (paths[index], f.channels, channels))
+                else:
+                    lengths[index] = f.read(frames, out=out[index])[1]
+            finally:
+                f.close()
+        except Exception as e:
+            out[index] = 0
+            errors[index] = e
+
+    pool = ThreadPool(max_workers)
+    try:
+        pool.map(read_into, range(len(paths)), chunksize=1)
+    finally:
+        pool.terminate()
+        pool.join()
+    return out, lengths, errors
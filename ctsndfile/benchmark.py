@@ -0,0 +1,250 @@
+"""
+Read/write throughput benchmark of the wrapper.
+
+Synthetic fixtures are generated locally (once, they are reused if the
+fixtures directory is kept) for every format, number of channels and
+duration asked, then every read and write mode is timed for every dtype of
+data_types_match and the results are written as JSON, to track regressions
+between releases:
+
+    python -m ctsndfile.benchmark --channels 1,2,64 --durations 10,3600 -o bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from ctsndfile.libsndfile import (_lib, SndFile, SndFileError, OPEN_MODES,
+                                  FILE_FORMATS, data_types_match)
+from ctsndfile.batch import read_many
+
+# fixture name -> (extension, format)
+FIXTURE_FORMATS = OrderedDict([
+    ("wav_pcm16", ("wav", FILE_FORMATS.SF_FORMAT_WAV|FILE_FORMATS.SF_FORMAT_PCM_16)),
+    ("wav_pcm24", ("wav", FILE_FORMATS.SF_FORMAT_WAV|FILE_FORMATS.SF_FORMAT_PCM_24)),
+    ("wav_float", ("wav", FILE_FORMATS.SF_FORMAT_WAV|FILE_FORMATS.SF_FORMAT_FLOAT)),
+    ("rf64_pcm16", ("rf64", FILE_FORMATS.SF_FORMAT_RF64|FILE_FORMATS.SF_FORMAT_PCM_16)),
+    ("flac_pcm16", ("flac", FILE_FORMATS.SF_FORMAT_FLAC|FILE_FORMATS.SF_FORMAT_PCM_16)),
+    ("ogg_vorbis", ("ogg", FILE_FORMATS.SF_FORMAT_OGG|FILE_FORMATS.SF_FORMAT_VORBIS)),
+])
+
+_UNCOMPRESSED = ("wav_pcm16", "wav_pcm24", "wav_float", "rf64_pcm16")
+
+# bytes decoded at once by the read and read_many cases, which read the first
+# frames of long fixtures only, so hours of 64 channels fit in memory
+MAX_READ_BYTES = 1 << 30
+
+
+def make_fixture(directory, name, channels, seconds, samplerate=48000, blocksize=1 << 16):
+    """ writes (unless it already exists) a fixture of the FIXTURE_FORMATS
+    name made of sines and noise, and returns its path """
+    extension, format_ = FIXTURE_FORMATS[name]
+    path = os.path.join(directory, "%s_%dch_%gs.%s" % (name, channels, seconds, extension))
+    if os.path.exists(path):
+        return path
+    random = np.random.RandomState(0)
+    frequencies = 110.*(1 + np.arange(channels))
+    f = SndFile(path + ".tmp", OPEN_MODES.SFM_WRITE, writeSamplerate=samplerate,
+                writeFormat=format_, writeNbChannels=channels)
+    try:
+        nbFrames = int(seconds*samplerate)
+        for start in range(0, nbFrames, blocksize):
+            t = np.arange(start, min(start + blocksize, nbFrames))[:, None]/float(samplerate)
+            block = 0.25*np.sin(2*np.pi*frequencies*t) + 0.05*random.randn(len(t), channels)
+            f.write(block.astype(np.float32))
+    finally:
+        f.close()
+    os.rename(path + ".tmp", path)
+    return path
+
+
+def _best(function, repeat):
+    """ returns the shortest time of repeat calls to function, or of the
+    times they return if they time themselves """
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        elapsed = function()
+        if elapsed is None:
+            elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def _result(case, fixture, path, channels, seconds, dtype, nbFrames, elapsed, **extra):
+    nbBytes = nbFrames*channels*np.dtype(dtype).itemsize
+    result = OrderedDict([
+        ("case", case), ("fixture", fixture), ("channels", channels),
+        ("duration", seconds), ("dtype", np.dtype(dtype).name),
+        ("file_bytes", os.path.getsize(path)), ("frames", nbFrames),
+        ("bytes", nbBytes), ("seconds", elapsed),
+        ("frames_per_second", nbFrames/elapsed if elapsed else None),
+        ("mb_per_second", nbBytes/elapsed/1e6 if elapsed else None),
+    ])
+    result.update(extra)
+    return result
+
+
+def bench_fixture(path, fixture, channels, seconds, dtypes, blocksizes, windows=100,
+                  window=4096, batch=8, repeat=3, tmp_dir=None, max_read_bytes=MAX_READ_BYTES):
+    """ times every read and write mode on the fixture path, returns the
+    results. The read and read_many cases decode at most max_read_bytes at
+    once (the first frames of the fixture), the other cases stream it. """
+    results = []
+    f = SndFile(path)
+    nbFrames = f.nbFrames
+    random = np.random.RandomState(0)
+    starts = random.randint(0, max(nbFrames - window, 1), windows)
+
+    for dtype in dtypes:
+        frameBytes = channels*np.dtype(dtype).itemsize
+        readFrames = max(1, min(nbFrames, max_read_bytes//frameBytes))
+        def read():
+            f.seek(0)
+            f.read(readFrames, dtype=dtype)
+        results.append(_result("read", fixture, path, channels, seconds, dtype, readFrames,
+                               _best(read, repeat)))
+
+        out = np.empty((window, channels), dtype)
+        def read_from_to():
+            for start in starts:
+                f.readFromTo(start, start + window, out=out)
+        results.append(_result("readFromTo", fixture, path, channels, seconds, dtype,
+                               windows*window, _best(read_from_to, repeat), window=window))
+
+        for blocksize in blocksizes:
+            def blocks():
+                f.seek(0)
+                for block in f.blocks(blocksize, dtype=dtype):
+                    pass
+            results.append(_result("blocks", fixture, path, channels, seconds, dtype, nbFrames,
+                                    _best(blocks, repeat), blocksize=blocksize))
+
+        # each result is kept until the next one is decoded
+        manyFrames = max(1, min(nbFrames, max_read_bytes//(2*frameBytes)))
+        def many():
+            for result in read_many([path]*batch, dtype=dtype, frames=manyFrames):
+                if result.error is not None:
+                    raise result.error
+        results.append(_result("read_many", fixture, path, channels, seconds, dtype,
+                               batch*manyFrames, _best(many, repeat), files=batch))
+
+        target = os.path.join(tmp_dir or os.path.dirname(path), "write_" + os.path.basename(path))
+        def write():
+            """ times the writes only, the frames being decoded block by block """
+            g = SndFile(target, OPEN_MODES.SFM_WRITE, writeSamplerate=f.samplerate,
+                        writeFormat=f.format, writeNbChannels=channels)
+            elapsed = 0.
+            try:
+                f.seek(0)
+                for block in f.blocks(1 << 16, dtype=dtype):
+                    start = time.time()
+                    g.write(block)
+                    elapsed += time.time() - start
+            finally:
+                start = time.time()
+                g.close()
+                elapsed += time.time() - start
+            return elapsed
+        results.append(_result("write", fixture, path, channels, seconds, dtype, nbFrames,
+                               _best(write, repeat)))
+        os.remove(target)
+
+    if fixture in _UNCOMPRESSED:
+        mapped = f.memmap()
+        def memmap():
+            for start in range(0, nbFrames, 1 << 16):
+                np.asarray(mapped[start:start + (1 << 16)]).sum()
+        results.append(_result("memmap", fixture, path, channels, seconds, mapped.dtype,
+                               nbFrames, _best(memmap, repeat)))
+    f.close()
+    return results
+
+
+def run(fixtures_dir, formats=None, channels=(1, 2), durations=(10,), dtypes=None,
+        blocksizes=(1024, 65536), repeat=3, log=None, max_read_bytes=MAX_READ_BYTES):
+    """ generates the fixtures and benchmarks them, returns a JSON-able dict
+    describing the environment and the results """
+    formats = formats or list(FIXTURE_FORMATS)
+    dtypes = dtypes or sorted(data_types_match, key=lambda dtype: np.dtype(dtype).name)
+    results = []
+    skipped = []
+    for fixture in formats:
+        for nbChannels in channels:
+            for seconds in durations:
+                try:
+                    path = make_fixture(fixtures_dir, fixture, nbChannels, seconds)
+                except SndFileError as e:
+                    skipped.append({"fixture": fixture, "channels": nbChannels,
+                                    "duration": seconds, "error": str(e)})
+                    continue
+                if log is not None:
+                    log.write("%s %dch %gs\n" % (fixture, nbChannels, seconds))
+                results.extend(bench_fixture(path, fixture, nbChannels, seconds, dtypes,
+                                             blocksizes, repeat=repeat,
+                                             max_read_bytes=max_read_bytes))
+    return OrderedDict([
+        ("environment", OrderedDict([
+            ("libsndfile", _lib.sf_version_string()),
+            ("numpy", np.__version__),
+            ("python", platform.python_version()),
+            ("platform", platform.platform()),
+            ("time", time.strftime("%Y-%m-%dT%H:%M:%S")),
+        ])),
+        ("results", results),
+        ("skipped", skipped),
+    ])
+
+
+def _list(type_):
+    return lambda value: [type_(item) for item in value.split(",") if item]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--formats", type=_list(str), default=list(FIXTURE_FORMATS),
+                        help="fixtures among %s" % ",".join(FIXTURE_FORMATS))
+    parser.add_argument("--channels", type=_list(int), default=[1, 2])
+    parser.add_argument("--durations", type=_list(float), default=[10.],
+                        help="fixtures durations in seconds")
+    parser.add_argument("--dtypes", type=_list(np.dtype), default=None,
+                        help="among int16,int32,float32,float64 (all by default)")
+    parser.add_argument("--blocksizes", type=_list(int), default=[1024, 65536])
+    parser.add_argument("--repeat", type=int, default=3, help="best of that many runs")
+    parser.add_argument("--max-read-mb", type=float, default=MAX_READ_BYTES/1e6,
+                        help="decoded at once by the read cases, which read the first "
+                             "frames of longer fixtures")
+    parser.add_argument("--fixtures-dir", default=None,
+                        help="where fixtures are generated and kept (temporary by default)")
+    parser.add_argument("-o", "--output", default=None, help="JSON output (stdout by default)")
+    args = parser.parse_args(argv)
+
+    fixtures_dir = args.fixtures_dir or tempfile.mkdtemp()
+    try:
+        if not os.path.isdir(fixtures_dir):
+            os.makedirs(fixtures_dir)
+        dtypes = [dtype.type for dtype in args.dtypes] if args.dtypes else None
+        report = run(fixtures_dir, args.formats, args.channels, args.durations, dtypes,
+                     args.blocksizes, args.repeat, log=sys.stderr,
+                     max_read_bytes=int(args.max_read_mb*1e6))
+    finally:
+        if args.fixtures_dir is None:
+            shutil.rmtree(fixtures_dir)
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+LRU cache of decoded blocks, shared by SndFile instances.
+
+Caching is opt-in: set SndFile.block_cache to a BlockCache to cache the
+blocks decoded by every instance, or set it on a single instance. Reads
+from files opened for reading by name are then served by copying the
+cached blocks, which are decoded on a miss.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class BlockCache(object):
+    """ decoded blocks of blocksize frames, keyed by (path, mtime, size,
+    dtype, block index), evicted least recently used first once they take more
+    than max_bytes. Safe to use from several threads. """
+
+    def __init__(self, max_bytes=256 << 20, blocksize=1 << 16):
+        self.max_bytes = max_bytes
+        self.blocksize = blocksize
+        self.nbytes = 0
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def get(self, key):
+        """ returns the cached block or None """
+        with self._lock:
+            block = self._blocks.pop(key, None)
+            if block is None:
+                self.misses += 1
+                return None
+            self._blocks[key] = block
+            self.hits += 1
+            return block
+
+    def put(self, key, block):
+        """ caches block, made read only, unless it's larger than the cache """
+        if block.nbytes > self.max_bytes:
+            return
+        block.flags.writeable = False
+        with self._lock:
+            previous = self._blocks.pop(key, None)
+            if previous is not None:
+                self.nbytes -= previous.nbytes
+            self._blocks[key] = block
+            self.nbytes += block.nbytes
+            while self.nbytes > self.max_bytes:
+                self.nbytes -= self._blocks.popitem(last=False)[1].nbytes
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """ returns the hit, miss and eviction counters, the number of blocks
+        and bytes cached """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "blocks": len(self._blocks),
+                    "bytes": self.nbytes}
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
@@ -0,0 +1,144 @@
+"""
+Several files read as one, such as a session recorded in hourly segments.
+"""
+
+from bisect import bisect_right
+
+import numpy as np
+
+from ctsndfile.libsndfile import SndFile, SEEK_MODES
+from ctsndfile.sampler import _HandlePool
+
+
+class SndFileSet(object):
+    """ the files in paths concatenated in one timeline of nbFrames frames.
+    All the files must have the same number of channels and samplerate.
+    Global frames are mapped to (file, frame) by binary search in the
+    cumulated numbers of frames of the files, which are opened once to count
+    them (unless given as nbFrames). Reads spanning several files are decoded
+    directly into one output array. At most max_open files are kept open,
+    opened with opener (SndFile, or IndexedSndFile for frame accurate
+    OGG/Vorbis windows, which seeking with libsndfile isn't). """
+
+    def __init__(self, paths, max_open=8, opener=SndFile, nbFrames=None):
+        self.paths = list(paths)
+        if not self.paths:
+            raise Exception("SndFileSet needs at least one file")
+        self._handles = _HandlePool(opener, max_open)
+        self.channels = None
+        self.samplerate = None
+        counts = []
+        for i, path in enumerate(self.paths):
+            if nbFrames is not None and self.channels is not None:
+                counts.append(nbFrames[i])
+                continue
+            f = self._handles.acquire(path)
+            try:
+                if self.channels is None:
+                    self.channels, self.samplerate = f.channels, f.samplerate
+                elif (f.channels, f.samplerate) != (self.channels, self.samplerate):
+                    raise Exception("%s has %d channels at %d Hz, expected %d at %d Hz"
+                                    % (path, f.channels, f.samplerate,
+                                       self.channels, self.samplerate))
+                counts.append(f.nbFrames if nbFrames is None else nbFrames[i])
+            finally:
+                self._handles.release(path, f)
+        # global frame at which each file starts, and the total
+        self._starts = [0]
+        for count in counts:
+            self._starts.append(self._starts[-1] + count)
+        self.currentPosition = 0
+
+    @property
+    def nbFrames(self):
+        """ the total number of frames of the files """
+        return self._starts[-1]
+
+    def locate(self, frame):
+        """ returns the index of the file holding the global frame and the
+        frame in that file """
+        index = bisect_right(self._starts, frame) - 1
+        index = min(max(index, 0), len(self.paths) - 1)
+        return index, frame - self._starts[index]
+
+    def seek(self, frame_position, whence=SEEK_MODES.SEEK_SET):
+        """ seek to a global position, seek modes are those specified in
+        SEEK_MODES. Raises an exception if tried to seek beyond the borders of
+        the files. Else returns the current offset."""
+        if whence == SEEK_MODES.SEEK_CUR:
+            frame_position += self.currentPosition
+        elif whence == SEEK_MODES.SEEK_END:
+            frame_position += self.nbFrames
+        if not 0 <= frame_position <= self.nbFrames:
+            raise Exception("can't seek to frame %d of %d" % (frame_position, self.nbFrames))
+        self.currentPosition = frame_position
+        return frame_position
+
+    def read(self, nbFrames=None, dtype=np.float32, out=None, channels=None, mix=None):
+        """ same as SndFile.read from the current global position """
+        if nbFrames is None and out is None:
+            nbFrames = self.nbFrames - self.currentPosition
+        return self.readFromTo(self.currentPosition,
+                               self.currentPosition + (nbFrames if nbFrames is not None
+                                                       else len(out)),
+                               dtype, out, channels, mix)
+
+    def readFromTo(self, startFrame, stopFrame, dtype=np.float32, out=None,
+                   channels=None, mix=None):
+        """ same as SndFile.readFromTo with global frames, the frames of each
+        file being decoded directly into their part of the output array """
+        if stopFrame<=startFrame and startFrame>=0:
+            raise Exception("Please choose stopFrame > startFrame >= 0")
+        nbFrames = stopFrame - startFrame
+        dtype = self._dtype(dtype, startFrame)
+        if out is None:
+            if mix is not None:
+                width = np.asarray(mix).reshape(self.channels, -1).shape[1]
+            elif channels is not None:
+                width = len(np.asarray(channels).reshape(-1))
+            else:
+                width = self.channels
+            out = np.empty((nbFrames, width), dtype)
+        elif len(out) < nbFrames or not out.flags.c_contiguous:
+            raise Exception("out must be a C-contiguous array of at least %d frames" % nbFrames)
+
+        position = startFrame
+        index, frame = self.locate(startFrame)
+        while position < min(stopFrame, self.nbFrames) and index < len(self.paths):
+            count = min(stopFrame, self._starts[index + 1]) - position
+            if count > 0:
+                path = self.paths[index]
+                handle = self._handles.acquire(path)
+                try:
+                    nbFramesRead = handle.readFromTo(
+                        frame, frame + count, dtype,
+                        out[position - startFrame:position - startFrame + count],
+                        channels, mix)[1]
+                finally:
+                    self._handles.release(path, handle)
+                position += nbFramesRead
+                if nbFramesRead < count:
+                    break
+            index, frame = index + 1, 0
+        out[position - startFrame:nbFrames] = 0
+        self.currentPosition = min(position, self.nbFrames)
+        return out, position - startFrame
+
+    def _dtype(self, dtype, frame):
+        """ class internal, returns the numpy type of dtype, "native" being
+        that of the file holding frame """
+        path = self.paths[self.locate(frame)[0]]
+        handle = self._handles.acquire(path)
+        try:
+            return handle._dtype(dtype)
+        finally:
+            self._handles.release(path, handle)
+
+    def close(self):
+        self._handles.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -0,0 +1,228 @@
+"""
+Instrumentation of the libsndfile calls made by SndFile.
+
+Once enabled, the SndFile instances opened afterwards go through a proxy of
+the library that times sf_open, sf_open_fd, sf_open_virtual, sf_seek,
+sf_read_*, sf_write_* and sf_close, counting calls, frames and bytes moved
+and keeping latency histograms per function, file format and dtype.
+Subscribers are called with every CallEvent for tracing. When disabled
+(the default) SndFile calls libsndfile directly, so it costs nothing.
+
+    from ctsndfile import instrument
+    instrument.enable()
+    ...
+    metrics = instrument.snapshot()
+"""
+
+import threading
+from bisect import bisect_left
+from collections import namedtuple
+from timeit import default_timer
+
+import numpy as np
+
+from ctsndfile import libsndfile
+from ctsndfile.libsndfile import FILE_FORMATS, data_types_match
+
+# upper bounds in seconds of the latency histogram buckets, 1us to ~34s,
+# the last bucket holds the slower calls
+BUCKETS = tuple(1e-6*2**i for i in range(26))
+
+CallEvent = namedtuple("CallEvent", ["function", "format", "dtype", "seconds",
+                                     "frames", "bytes", "result"])
+
+_OPEN_FUNCTIONS = ("sf_open", "sf_open_fd", "sf_open_virtual")
+
+_MAJOR_NAMES = {}
+_SUBTYPE_NAMES = {}
+for _name, _value in vars(FILE_FORMATS).items():
+    if not _name.startswith("SF_FORMAT_") or _name.endswith("MASK"):
+        continue
+    if _value & FILE_FORMATS.SF_FORMAT_TYPEMASK:
+        _MAJOR_NAMES[_value] = _name[len("SF_FORMAT_"):]
+    else:
+        _SUBTYPE_NAMES[_value] = _name[len("SF_FORMAT_"):]
+
+# ctypes name -> (dtype name, bytes per sample)
+_SAMPLE_TYPES = dict((type_, (np.dtype(dtype).name, np.dtype(dtype).itemsize))
+                     for dtype, type_ in data_types_match.items())
+
+
+def format_name(format_):
+    """ returns a label such as "WAV/PCM_16" for a format of FILE_FORMATS """
+    major = _MAJOR_NAMES.get(format_ & FILE_FORMATS.SF_FORMAT_TYPEMASK, "0x%x" % format_)
+    subtype = _SUBTYPE_NAMES.get(format_ & FILE_FORMATS.SF_FORMAT_SUBMASK, "")
+    return "%s/%s" % (major, subtype) if subtype else major
+
+
+class _Metrics(object):
+    """ class internal, counters of one (function, format, dtype) """
+
+    def __init__(self):
+        self.calls = 0
+        self.frames = 0
+        self.bytes = 0
+        self.seconds = 0.
+        self.max_seconds = 0.
+        self.histogram = [0]*(len(BUCKETS) + 1)
+
+    def add(self, event):
+        self.calls += 1
+        self.frames += event.frames
+        self.bytes += event.bytes
+        self.seconds += event.seconds
+        self.max_seconds = max(self.max_seconds, event.seconds)
+        self.histogram[bisect_left(BUCKETS, event.seconds)] += 1
+
+    def as_dict(self):
+        return {"calls": self.calls, "frames": self.frames, "bytes": self.bytes,
+                "seconds": self.seconds, "max_seconds": self.max_seconds,
+                "histogram": list(self.histogram)}
+
+
+class Recorder(object):
+    """ collects the CallEvents of the instrumented calls """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._subscribers = []
+
+    def record(self, event):
+        with self._lock:
+            key = (event.function, event.format, event.dtype)
+            metrics = self._metrics.get(key)
+            if metrics is None:
+                metrics = self._metrics[key] = _Metrics()
+            metrics.add(event)
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback(event)
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers.remove(callback)
+
+    def snapshot(self):
+        """ returns a list of the metrics per function, format and dtype, each
+        a dict with calls, frames, bytes, total and max seconds and the
+        latency histogram over BUCKETS """
+        with self._lock:
+            items = sorted(self._metrics.items(), key=lambda item: tuple(str(k) for k in item[0]))
+            snapshot = []
+            for (function, format_, dtype), metrics in items:
+                entry = {"function": function, "format": format_, "dtype": dtype}
+                entry.update(metrics.as_dict())
+                snapshot.append(entry)
+            return snapshot
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+
+
+class _InstrumentedLib(object):
+    """ class internal, proxy of the library timing the calls of SndFile """
+
+    def __init__(self, lib, recorder):
+        self._lib = lib
+        self._recorder = recorder
+        # handle -> (format name, channels) of the files opened through the proxy
+        self._handles = {}
+        self._wrappers = {}
+
+    def __getattr__(self, name):
+        wrapper = self._wrappers.get(name)
+        if wrapper is None:
+            function = getattr(self._lib, name)
+            if name in _OPEN_FUNCTIONS:
+                wrapper = self._wrap_open(name, function)
+            elif name in ("sf_seek", "sf_close"):
+                wrapper = self._wrap_call(name, function)
+            elif name[:8] in ("sf_read_", "sf_write") and name.split("_")[-1] in _SAMPLE_TYPES:
+                wrapper = self._wrap_io(name, function)
+            else:
+                return function
+            self._wrappers[name] = wrapper
+        return wrapper
+
+    def _wrap_open(self, name, function):
+        def wrapper(*args):
+            start = default_timer()
+            handle = function(*args)
+            seconds = default_timer() - start
+            sf_info = args[2]
+            format_ = format_name(sf_info.format)
+            if handle:
+                self._handles[handle] = (format_, sf_info.channels)
+            self._recorder.record(CallEvent(name, format_, None, seconds, 0, 0, handle))
+            return handle
+        return wrapper
+
+    def _wrap_call(self, name, function):
+        def wrapper(handle, *args):
+            format_ = self._handles.get(handle, (None, 1))[0]
+            if name == "sf_close":
+                self._handles.pop(handle, None)
+            start = default_timer()
+            result = function(handle, *args)
+            seconds = default_timer() - start
+            self._recorder.record(CallEvent(name, format_, None, seconds, 0, 0, result))
+            return result
+        return wrapper
+
+    def _wrap_io(self, name, function):
+        dtype, itemsize = _SAMPLE_TYPES[name.split("_")[-1]]
+        def wrapper(handle, ptr, items):
+            start = default_timer()
+            result = function(handle, ptr, items)
+            seconds = default_timer() - start
+            format_, channels = self._handles.get(handle, (None, 1))
+            self._recorder.record(CallEvent(name, format_, dtype, seconds,
+                                            max(result, 0)//channels,
+                                            max(result, 0)*itemsize, result))
+            return result
+        return wrapper
+
+
+recorder = Recorder()
+_original = None
+
+
+def enabled():
+    return _original is not None
+
+
+def enable():
+    """ instruments the SndFile instances opened from now on """
+    global _original
+    if _original is not None:
+        return
+    libsndfile.load_library()
+    lib = _InstrumentedLib(libsndfile._lib, recorder)
+    _original = (libsndfile._lib, libsndfile._dispatch)
+    libsndfile._lib = lib
+    libsndfile._dispatch = dict(
+        (dtype, (pointer_type, getattr(lib, "sf_read_" + data_types_match[dtype]),
+                 getattr(lib, "sf_write_" + data_types_match[dtype])))
+        for dtype, (pointer_type, read_func, write_func) in _original[1].items())
+
+
+def disable():
+    """ stops instrumenting the SndFile instances opened from now on, those
+    opened while enabled are still counted until they're closed """
+    global _original
+    if _original is None:
+        return
+    libsndfile._lib, libsndfile._dispatch = _original
+    _original = None
+
+
+subscribe = recorder.subscribe
+unsubscribe = recorder.unsubscribe
+snapshot = recorder.snapshot
+reset = recorder.reset
@@ -9,46 +9,88 @@ licensed under the LGPL
 All sounds formats supported by libsndfile are available and a class interface
 is implemented with some helper methods.
 
-Requires numpy and ctypes. Tested under windows only.
+Requires numpy and ctypes. Tested under windows only. Runs on Python 2 and 3.
 """
 
+from __future__ import print_function
+
+import io
 import os
 import sys
 
 try:
     import ctypes as ct
 except ImportError:
-    print "this module requires ctypes"
+    print("this module requires ctypes")
     sys.exit(-1)
 try:
     import numpy as np
 except ImportError:
-    print "this module requires numpy"
+    print("this module requires numpy")
     sys.exit(-1)
 
+import threading
 from ctypes.util import find_library
 
-_lib = None
+try:
+    _string_types = basestring
+    # the files open() returns, read through their file descriptor
+    _file_types = (file,)
+except NameError:
+    _string_types = str
+    _file_types = (io.FileIO, io.BufferedReader, io.BufferedWriter, io.BufferedRandom,
+                   io.TextIOWrapper)
 
 if os.name == "nt":
     shared_object_name = 'libsndfile-1'
 else:
     shared_object_name = 'sndfile'
 
-
-
-path = find_library(shared_object_name)
-if path is None:
-    print "library libsndfile not found"
-    sys.exit(-1)
-
-_lib = ct.CDLL(path)
-
-
-_lib.sf_version_string.restype = ct.c_char_p
-_lib.sf_version_string.argtypes = None
-#print "libsndfile loaded version:", _lib.sf_version_string()
-
+# path of the library to load, skips the find_library lookup if set
+LIBRARY_PATH_VARIABLE = "CTSNDFILE_LIBRARY"
+
+
+class _Library(object):
+    """ class internal, stands for libsndfile until it's loaded on first use,
+    then caches its functions as attributes """
+
+    def __init__(self):
+        self._cdll = None
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        load_library()
+        function = getattr(self._cdll, name)
+        setattr(self, name, function)
+        return function
+
+_lib = _Library()
+_load_lock = threading.Lock()
+
+
+def load_library(path=None):
+    """ loads libsndfile, which is done automatically the first time it's
+    needed. The library is loaded from path if given, else from the path in
+    the CTSNDFILE_LIBRARY environment variable, else it's searched with
+    ctypes.util.find_library (which may spawn ldconfig or gcc).
+    Call it to load a specific build or to fail early. Does nothing if the
+    library is already loaded, raises an OSError if it can't be found. """
+    with _load_lock:
+        if _lib._cdll is not None:
+            return
+        if path is None:
+            path = os.environ.get(LIBRARY_PATH_VARIABLE) or find_library(shared_object_name)
+        if path is None:
+            raise OSError("library libsndfile not found, set %s to its path"
+                          % LIBRARY_PATH_VARIABLE)
+        cdll = ct.CDLL(path)
+        __init_lib_methods(cdll)
+        for dtype, type_ in data_types_match.items():
+            _dispatch[dtype] = (ct.POINTER(getattr(ct, "c_" + type_)),
+                                getattr(cdll, "sf_read_" + type_),
+                                getattr(cdll, "sf_write_" + type_))
+        _lib._cdll = cdll
 
 
 class FILE_FORMATS():
@@ -147,6 +189,12 @@ SF_ERR_SYSTEM                 = 2
 SF_ERR_MALFORMED_FILE         = 3
 SF_ERR_UNSUPPORTED_ENCODING   = 4
 
+class SndFileError(Exception):
+    """ raised when libsndfile can't open a file, errno is the sf_error code """
+    def __init__(self, message, errno=None):
+        Exception.__init__(self, message)
+        self.errno = errno
+
 
 #other definitions :
 sf_count_t = ct.c_longlong
@@ -161,45 +209,83 @@ class SF_INFO(ct.Structure):
                 ("sections", ct.c_int),
                 ("seekable", ct.c_int)]
 
-def __init_lib_methods():
-    SNDFILE = ct.c_int
+# virtual I/O callbacks, user_data is unused as the callbacks are closures
+sf_vio_get_filelen = ct.CFUNCTYPE(sf_count_t, ct.c_void_p)
+sf_vio_seek = ct.CFUNCTYPE(sf_count_t, sf_count_t, ct.c_int, ct.c_void_p)
+sf_vio_read = ct.CFUNCTYPE(sf_count_t, ct.c_void_p, sf_count_t, ct.c_void_p)
+sf_vio_write = ct.CFUNCTYPE(sf_count_t, ct.c_void_p, sf_count_t, ct.c_void_p)
+sf_vio_tell = ct.CFUNCTYPE(sf_count_t, ct.c_void_p)
+
+class SF_VIRTUAL_IO(ct.Structure):
+    _fields_ = [("get_filelen", sf_vio_get_filelen),
+                ("seek", sf_vio_seek),
+                ("read", sf_vio_read),
+                ("write", sf_vio_write),
+                ("tell", sf_vio_tell)]
+
+def _text(result, function=None, arguments=None):
+    """ errcheck of the functions returning strings, which are bytes on
+    Python 3 """
+    if result is not None and not isinstance(result, str):
+        return result.decode("utf-8", "replace")
+    return result
+
+def _encode_path(path):
+    """ returns path as the bytes sf_open takes """
+    if isinstance(path, bytes):
+        return path
+    return path.encode(sys.getfilesystemencoding() or "utf-8")
+
+def __init_lib_methods(lib):
+    SNDFILE = ct.c_void_p
+
+    lib.sf_version_string.restype = ct.c_char_p
+    lib.sf_version_string.argtypes = None
+    lib.sf_version_string.errcheck = _text
 
     #SNDFILE*     sf_open        (const char *path, int mode, SF_INFO *sfinfo) ;
-    _lib.sf_open.restype = SNDFILE
-    _lib.sf_open.argtypes = [ct.c_char_p, ct.c_int, ct.POINTER(SF_INFO)]
+    lib.sf_open.restype = SNDFILE
+    lib.sf_open.argtypes = [ct.c_char_p, ct.c_int, ct.POINTER(SF_INFO)]
 
     #SNDFILE*  sf_open_fd (int fd, int mode, SF_INFO *sfinfo, int close_desc) ;
-    _lib.sf_open_fd.restype = SNDFILE
-    _lib.sf_open_fd.argtypes = [ct.c_int, ct.c_int, ct.POINTER(SF_INFO), ct.c_int]
+    lib.sf_open_fd.restype = SNDFILE
+    lib.sf_open_fd.argtypes = [ct.c_int, ct.c_int, ct.POINTER(SF_INFO), ct.c_int]
+
+    #SNDFILE*  sf_open_virtual (SF_VIRTUAL_IO *sfvirtual, int mode, SF_INFO *sfinfo, void *user_data) ;
+    lib.sf_open_virtual.restype = SNDFILE
+    lib.sf_open_virtual.argtypes = [ct.POINTER(SF_VIRTUAL_IO), ct.c_int,
+                                    ct.POINTER(SF_INFO), ct.c_void_p]
 
     #int        sf_error        (SNDFILE *sndfile) ;
-    _lib.sf_error.restype = ct.c_int
-    _lib.sf_error.argtypes = [SNDFILE]
+    lib.sf_error.restype = ct.c_int
+    lib.sf_error.argtypes = [SNDFILE]
 
     #const char* sf_strerror (SNDFILE *sndfile) ;
-    _lib.sf_strerror.restype = ct.c_char_p
-    _lib.sf_strerror.argtypes = [SNDFILE]
+    lib.sf_strerror.restype = ct.c_char_p
+    lib.sf_strerror.argtypes = [SNDFILE]
+    lib.sf_strerror.errcheck = _text
 
     #int        sf_format_check    (const SF_INFO *info) ;
-    _lib.sf_format_check.restype = ct.c_int
-    _lib.sf_format_check.argtypes = [ct.POINTER(SF_INFO)]
+    lib.sf_format_check.restype = ct.c_int
+    lib.sf_format_check.argtypes = [ct.POINTER(SF_INFO)]
 
     #sf_count_t    sf_seek         (SNDFILE *sndfile, sf_count_t frames, int whence) ;
-    _lib.sf_seek.restype = sf_count_t
-    _lib.sf_seek.argtypes = [SNDFILE, sf_count_t, ct.c_int]
+    lib.sf_seek.restype = sf_count_t
+    lib.sf_seek.argtypes = [SNDFILE, sf_count_t, ct.c_int]
 
     #const char* sf_get_string (SNDFILE *sndfile, int str_type) ;
-    _lib.sf_get_string.restype = ct.c_char_p
-    _lib.sf_get_string.argtypes = [SNDFILE, ct.c_int]
+    lib.sf_get_string.restype = ct.c_char_p
+    lib.sf_get_string.argtypes = [SNDFILE, ct.c_int]
+    lib.sf_get_string.errcheck = _text
 
     #int         sf_set_string    (SNDFILE *sndfile, int str_type, const char* str) ;
     #TODO
-    #_lib.sf_set_string.restype = ct.c_int
-    #_lib.sf_set_string.argtypes = [SNDFILE, ct.c_int, ct.c_char_p]
+    #lib.sf_set_string.restype = ct.c_int
+    #lib.sf_set_string.argtypes = [SNDFILE, ct.c_int, ct.c_char_p]
 
     #sf_count_t    sf_read_raw        (SNDFILE *sndfile, void *ptr, sf_count_t bytes) ;
-    _lib.sf_read_raw.restype = sf_count_t
-    _lib.sf_read_raw.argtypes = [SNDFILE, ct.c_void_p, sf_count_t]
+    lib.sf_read_raw.restype = sf_count_t
+    lib.sf_read_raw.argtypes = [SNDFILE, ct.c_void_p, sf_count_t]
 
     # Functions for reading and writing the data chunk in terms of frames.
     # The number of items actually read/written = frames * number of channels.
@@ -210,38 +296,45 @@ def __init_lib_methods():
     #     sf_xxxx_double    passes data in the native double format
     # All of these read/write function return number of frames read/written.
     #sf_count_t    sf_readf_float    (SNDFILE *sndfile, float *ptr, sf_count_t frames) ;
-    _lib.sf_read_float.restype = sf_count_t
-    _lib.sf_read_float.argtypes = [SNDFILE, ct.POINTER(ct.c_float), sf_count_t]
-    _lib.sf_read_double.restype = sf_count_t
-    _lib.sf_read_double.argtypes = [SNDFILE, ct.POINTER(ct.c_double), sf_count_t]
-    _lib.sf_read_short.restype = sf_count_t
-    _lib.sf_read_short.argtypes = [SNDFILE, ct.POINTER(ct.c_short), sf_count_t]
-    _lib.sf_read_int.restype = sf_count_t
-    _lib.sf_read_int.argtypes = [SNDFILE, ct.POINTER(ct.c_int), sf_count_t]
+    lib.sf_read_float.restype = sf_count_t
+    lib.sf_read_float.argtypes = [SNDFILE, ct.POINTER(ct.c_float), sf_count_t]
+    lib.sf_read_double.restype = sf_count_t
+    lib.sf_read_double.argtypes = [SNDFILE, ct.POINTER(ct.c_double), sf_count_t]
+    lib.sf_read_short.restype = sf_count_t
+    lib.sf_read_short.argtypes = [SNDFILE, ct.POINTER(ct.c_short), sf_count_t]
+    lib.sf_read_int.restype = sf_count_t
+    lib.sf_read_int.argtypes = [SNDFILE, ct.POINTER(ct.c_int), sf_count_t]
 
     #sf_count_t    sf_write_raw     (SNDFILE *sndfile, const void *ptr, sf_count_t bytes) ;
-    _lib.sf_write_raw.restype = sf_count_t
-    _lib.sf_write_raw.argtypes = [SNDFILE, ct.c_void_p, sf_count_t]
+    lib.sf_write_raw.restype = sf_count_t
+    lib.sf_write_raw.argtypes = [SNDFILE, ct.c_void_p, sf_count_t]
+
+    #int        sf_command    (SNDFILE *sndfile, int command, void *data, int datasize) ;
+    lib.sf_command.restype = ct.c_int
+    lib.sf_command.argtypes = [SNDFILE, ct.c_int, ct.c_void_p, ct.c_int]
+
+    #void       sf_write_sync    (SNDFILE *sndfile) ;
+    lib.sf_write_sync.restype = None
+    lib.sf_write_sync.argtypes = [SNDFILE]
 
     #int        sf_close        (SNDFILE *sndfile) ;
-    _lib.sf_close.restype = ct.c_int
-    _lib.sf_close.argtypes = [SNDFILE]
+    lib.sf_close.restype = ct.c_int
+    lib.sf_close.argtypes = [SNDFILE]
 
     #writing functions
     #sf_count_t  sf_write_short   (SNDFILE *sndfile, short *ptr, sf_count_t items) ;
     #sf_count_t  sf_write_int     (SNDFILE *sndfile, int *ptr, sf_count_t items) ;
     #sf_count_t  sf_write_float   (SNDFILE *sndfile, float *ptr, sf_count_t items) ;
     #sf_count_t  sf_write_double  (SNDFILE *sndfile, double *ptr, sf_count_t items) ;
-    _lib.sf_write_int.restype = sf_count_t
-    _lib.sf_write_int.argtypes = [SNDFILE, ct.POINTER(ct.c_int), sf_count_t]
-    _lib.sf_write_short.restype = sf_count_t
-    _lib.sf_write_short.argtypes = [SNDFILE, ct.POINTER(ct.c_short), sf_count_t]
-    _lib.sf_write_float.restype = sf_count_t
-    _lib.sf_write_float.argtypes = [SNDFILE, ct.POINTER(ct.c_float), sf_count_t]
-    _lib.sf_write_double.restype = sf_count_t
-    _lib.sf_write_double.argtypes = [SNDFILE, ct.POINTER(ct.c_double), sf_count_t]
+    lib.sf_write_int.restype = sf_count_t
+    lib.sf_write_int.argtypes = [SNDFILE, ct.POINTER(ct.c_int), sf_count_t]
+    lib.sf_write_short.restype = sf_count_t
+    lib.sf_write_short.argtypes = [SNDFILE, ct.POINTER(ct.c_short), sf_count_t]
+    lib.sf_write_float.restype = sf_count_t
+    lib.sf_write_float.argtypes = [SNDFILE, ct.POINTER(ct.c_float), sf_count_t]
+    lib.sf_write_double.restype = sf_count_t
+    lib.sf_write_double.argtypes = [SNDFILE, ct.POINTER(ct.c_double), sf_count_t]
 
-__init_lib_methods()
 
 
 #class definitions :
@@ -256,6 +349,59 @@ class SEEK_MODES():
     SEEK_CUR = 1
     SEEK_END = 2
 
+# Commands accepted by sf_command, see the libsndfile documentation for the
+# data each of them expects.
+class COMMANDS():
+    SFC_GET_LIB_VERSION             = 0x1000
+    SFC_GET_LOG_INFO                = 0x1001
+    SFC_GET_CURRENT_SF_INFO         = 0x1002
+
+    SFC_GET_NORM_DOUBLE             = 0x1010
+    SFC_GET_NORM_FLOAT              = 0x1011
+    SFC_SET_NORM_DOUBLE             = 0x1012
+    SFC_SET_NORM_FLOAT              = 0x1013
+    SFC_SET_SCALE_FLOAT_INT_READ    = 0x1014
+    SFC_SET_SCALE_INT_FLOAT_WRITE   = 0x1015
+
+    SFC_CALC_SIGNAL_MAX             = 0x1040
+    SFC_CALC_NORM_SIGNAL_MAX        = 0x1041
+
+    SFC_SET_ADD_PEAK_CHUNK          = 0x1050
+
+    SFC_UPDATE_HEADER_NOW           = 0x1060
+    SFC_SET_UPDATE_HEADER_AUTO      = 0x1061
+
+    SFC_FILE_TRUNCATE               = 0x1080
+
+    SFC_SET_RAW_START_OFFSET        = 0x1090
+
+    SFC_SET_CLIPPING                = 0x10C0
+    SFC_GET_CLIPPING                = 0x10C1
+
+    SFC_RAW_DATA_NEEDS_ENDSWAP      = 0x1110
+
+SF_TRUE  = 1
+SF_FALSE = 0
+
+# uncompressed subtypes whose data can be mapped: subtype -> (numpy kind, bytes per sample)
+_mappable_subtypes = {
+    FILE_FORMATS.SF_FORMAT_PCM_S8: ("i", 1),
+    FILE_FORMATS.SF_FORMAT_PCM_U8: ("u", 1),
+    FILE_FORMATS.SF_FORMAT_PCM_16: ("i", 2),
+    FILE_FORMATS.SF_FORMAT_PCM_24: ("i", 3),
+    FILE_FORMATS.SF_FORMAT_PCM_32: ("i", 4),
+    FILE_FORMATS.SF_FORMAT_FLOAT: ("f", 4),
+    FILE_FORMATS.SF_FORMAT_DOUBLE: ("f", 8),
+}
+
+# containers storing such data as is, without compression
+_mappable_formats = set([
+    FILE_FORMATS.SF_FORMAT_WAV, FILE_FORMATS.SF_FORMAT_WAVEX,
+    FILE_FORMATS.SF_FORMAT_W64, FILE_FORMATS.SF_FORMAT_RF64,
+    FILE_FORMATS.SF_FORMAT_AIFF, FILE_FORMATS.SF_FORMAT_AU,
+    FILE_FORMATS.SF_FORMAT_CAF, FILE_FORMATS.SF_FORMAT_RAW,
+])
+
 data_types_match = {
     np.float64: "double",
     np.float32: "float",
@@ -263,19 +409,305 @@ data_types_match = {
     np.int16: "short",
 }
 
+# 8 bits dtypes, decoded as int16 whose high byte is kept: dtype -> offset
+# added to it (libsndfile returns unsigned data centered on 0)
+_narrow_types = {
+    np.int8: 0,
+    np.uint8: 128,
+}
+
+# subtype -> narrowest dtype holding its samples without loss, read with
+# dtype="native" (float32 for the subtypes not listed)
+native_types = {
+    FILE_FORMATS.SF_FORMAT_PCM_S8: np.int8,
+    FILE_FORMATS.SF_FORMAT_PCM_U8: np.uint8,
+    FILE_FORMATS.SF_FORMAT_DPCM_8: np.int8,
+    FILE_FORMATS.SF_FORMAT_PCM_16: np.int16,
+    FILE_FORMATS.SF_FORMAT_DPCM_16: np.int16,
+    FILE_FORMATS.SF_FORMAT_DWVW_12: np.int16,
+    FILE_FORMATS.SF_FORMAT_DWVW_16: np.int16,
+    FILE_FORMATS.SF_FORMAT_ULAW: np.int16,
+    FILE_FORMATS.SF_FORMAT_ALAW: np.int16,
+    FILE_FORMATS.SF_FORMAT_IMA_ADPCM: np.int16,
+    FILE_FORMATS.SF_FORMAT_MS_ADPCM: np.int16,
+    FILE_FORMATS.SF_FORMAT_GSM610: np.int16,
+    FILE_FORMATS.SF_FORMAT_VOX_ADPCM: np.int16,
+    FILE_FORMATS.SF_FORMAT_G721_32: np.int16,
+    FILE_FORMATS.SF_FORMAT_G723_24: np.int16,
+    FILE_FORMATS.SF_FORMAT_G723_40: np.int16,
+    FILE_FORMATS.SF_FORMAT_PCM_24: np.int32,
+    FILE_FORMATS.SF_FORMAT_PCM_32: np.int32,
+    FILE_FORMATS.SF_FORMAT_DWVW_24: np.int32,
+    FILE_FORMATS.SF_FORMAT_DWVW_N: np.int32,
+    FILE_FORMATS.SF_FORMAT_FLOAT: np.float32,
+    FILE_FORMATS.SF_FORMAT_VORBIS: np.float32,
+    FILE_FORMATS.SF_FORMAT_DOUBLE: np.float64,
+}
+
+# channels selected or mixed by read, readFromTo and blocks are decoded in
+# chunks of about that many bytes
+SELECT_CHUNK_BYTES = 1 << 20
+
+# dtype -> (ctypes pointer type, sf_read_xxx, sf_write_xxx functions), filled
+# when the library is loaded so reads and writes don't have to look them up
+# by name on every call
+_dispatch = {}
+
+class PCM24Map(object):
+    """ read only view of mapped 24 bit PCM data of shape (nbFrames, nbChannels).
+    Nothing is converted until indexed: indexing (on frames, and optionally
+    channels) converts only the selected samples to int32, scaled like
+    SndFile.read(dtype=np.int32) does. Use blocks to convert it in chunks. """
+
+    dtype = np.dtype(np.int32)
+
+    def __init__(self, raw, byteorder):
+        self._raw = raw
+        self._bytes = (0, 1, 2) if byteorder == "<" else (2, 1, 0)
+
+    @property
+    def shape(self):
+        return self._raw.shape[:2]
+
+    def __len__(self):
+        return len(self._raw)
+
+    def __getitem__(self, key):
+        raw = np.asarray(self._raw[key])
+        lo, mid, hi = self._bytes
+        data = raw[..., lo].astype(np.uint32) << 8
+        data |= raw[..., mid].astype(np.uint32) << 16
+        data |= raw[..., hi].astype(np.uint32) << 24
+        return data.view(np.int32)
+
+    def blocks(self, blocksize):
+        """ generator converting the data in blocks of blocksize frames """
+        for start in range(0, len(self), blocksize):
+            yield self[start:start+blocksize]
+
+class _VirtualIO(object):
+    """ class internal, base of the objects served to libsndfile through
+    sf_open_virtual. Subclasses implement get_filelen, seek, read, write and
+    tell with the semantics of the SF_VIRTUAL_IO callbacks. """
+    name = "<virtual>"
+
+    def __init__(self):
+        def guard(method):
+            def callback(*args):
+                try:
+                    return method(*args[:-1])
+                except Exception:
+                    return -1
+            return callback
+        self.sf_virtual_io = SF_VIRTUAL_IO(
+            sf_vio_get_filelen(guard(self.get_filelen)),
+            sf_vio_seek(guard(self.seek)),
+            sf_vio_read(guard(self.read)),
+            sf_vio_write(guard(self.write)),
+            sf_vio_tell(guard(self.tell)))
+
+class _BufferIO(_VirtualIO):
+    """ class internal, read only virtual I/O over an in-memory buffer (bytes,
+    bytearray, memoryview, numpy array...). The buffer is not copied, reads
+    are served by memmove from its memory. """
+
+    def __init__(self, buf):
+        _VirtualIO.__init__(self)
+        try:
+            self._data = np.asarray(memoryview(buf)).reshape(-1).view(np.uint8)
+        except TypeError:
+            # only the old buffer protocol, such as mmap on Python 2
+            self._data = np.frombuffer(buf, np.uint8)
+        self._address = self._data.ctypes.data
+        self._position = 0
+        self.name = "<buffer of %d bytes>" % self._data.size
+
+    def get_filelen(self):
+        return self._data.size
+
+    def seek(self, offset, whence):
+        if whence == SEEK_MODES.SEEK_CUR:
+            offset += self._position
+        elif whence == SEEK_MODES.SEEK_END:
+            offset += self._data.size
+        if offset < 0:
+            return -1
+        self._position = offset
+        return offset
+
+    def read(self, ptr, count):
+        count = max(0, min(count, self._data.size - self._position))
+        ct.memmove(ptr, self._address + self._position, count)
+        self._position += count
+        return count
+
+    def write(self, ptr, count):
+        return 0
+
+    def tell(self):
+        return self._position
+
+class _FileObjectIO(_VirtualIO):
+    """ class internal, virtual I/O over a python file-like object with
+    read/readinto, write, seek and tell (io.BytesIO for instance) """
+
+    def __init__(self, fileobj):
+        _VirtualIO.__init__(self)
+        self._fileobj = fileobj
+        self.name = getattr(fileobj, "name", "<%s>" % type(fileobj).__name__)
+
+    def get_filelen(self):
+        position = self._fileobj.tell()
+        self._fileobj.seek(0, SEEK_MODES.SEEK_END)
+        length = self._fileobj.tell()
+        self._fileobj.seek(position)
+        return length
+
+    def seek(self, offset, whence):
+        self._fileobj.seek(offset, whence)
+        return self._fileobj.tell()
+
+    def read(self, ptr, count):
+        if count <= 0:
+            return 0
+        return self._fileobj.readinto((ct.c_char*count).from_address(ptr)) or 0
+
+    def write(self, ptr, count):
+        self._fileobj.write(ct.string_at(ptr, count))
+        return count
+
+    def tell(self):
+        return self._fileobj.tell()
+
+class _StreamIO(_VirtualIO):
+    """ class internal, read only virtual I/O over a non-seekable reader, any
+    object with read(size) (a pipe, socket.makefile("rb"), an HTTP
+    response...). The last lookback bytes read are kept so libsndfile can
+    seek back while parsing headers. Its length is unknown, libsndfile is told
+    it's huge, and positions further than lookback bytes ahead (where
+    libsndfile looks for trailing chunks) read as the end of the stream,
+    without consuming it. """
+
+    LENGTH = 1 << 62
+
+    def __init__(self, reader, lookback):
+        _VirtualIO.__init__(self)
+        self._reader = reader
+        self._lookback = lookback
+        self._buffer = bytearray()
+        # offset in the stream of the first byte of _buffer
+        self._base = 0
+        self._position = 0
+        self._eof = False
+        self.name = getattr(reader, "name", "<stream>")
+
+    def _fill(self, end):
+        while not self._eof and self._base + len(self._buffer) < end:
+            chunk = self._reader.read(min(end - self._base - len(self._buffer), 1 << 16))
+            if not chunk:
+                self._eof = True
+            self._buffer += chunk
+
+    def peek(self, count):
+        """ returns the first count bytes of the stream, before it's read """
+        self._fill(count)
+        return bytes(self._buffer[:count])
+
+    def chunks(self):
+        """ generator of the bytes from the current position to the end """
+        if self._position < self._base + len(self._buffer):
+            yield bytes(self._buffer[self._position - self._base:])
+        self._buffer = bytearray()
+        while True:
+            chunk = self._reader.read(1 << 16)
+            if not chunk:
+                return
+            yield chunk
+
+    def get_filelen(self):
+        return self.LENGTH
+
+    def seek(self, offset, whence):
+        if whence == SEEK_MODES.SEEK_CUR:
+            offset += self._position
+        elif whence == SEEK_MODES.SEEK_END:
+            offset += self.LENGTH
+        if offset < self._base:
+            return -1
+        self._position = offset
+        return offset
+
+    def read(self, ptr, count):
+        end = self._base + len(self._buffer)
+        if count <= 0 or self._position > end + self._lookback:
+            return 0
+        self._fill(self._position + count)
+        start = self._position - self._base
+        count = max(0, min(count, len(self._buffer) - start))
+        if count:
+            source = (ct.c_char*count).from_buffer(self._buffer, start)
+            ct.memmove(ptr, source, count)
+            del source
+        self._position += count
+        trim = self._position - self._lookback - self._base
+        if trim > 0:
+            del self._buffer[:trim]
+            self._base += trim
+        return count
+
+    def write(self, ptr, count):
+        return -1
+
+    def tell(self):
+        return self._position
+
+class _PipeFeeder(object):
+    """ class internal, copies the rest of a _StreamIO into an OS pipe on a
+    thread, for the formats libsndfile only streams from pipes (OGG). file is
+    the read end of the pipe. """
+
+    def __init__(self, stream):
+        read_fd, self._write_fd = os.pipe()
+        self.file = os.fdopen(read_fd, "rb")
+        self._thread = threading.Thread(target=self._run, args=(stream,),
+                                        name="_PipeFeeder")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, stream):
+        try:
+            for chunk in stream.chunks():
+                while chunk:
+                    chunk = chunk[os.write(self._write_fd, chunk):]
+        except EnvironmentError:
+            # the read end was closed
+            pass
+        finally:
+            os.close(self._write_fd)
+
+    def close(self):
+        self.file.close()
+
 class SndFile(object):
     """ Main Class of the wrapper, provides easy access to audio file contents """
 
+    # opt-in cache of decoded blocks (a ctsndfile.cache.BlockCache), shared by
+    # all the instances if set on the class
+    block_cache = None
+
     def __init__(self, file_, open_mode=OPEN_MODES.SFM_READ,
                  writeSamplerate = 48000,
                  writeFormat = FILE_FORMATS.SF_FORMAT_WAV^FILE_FORMATS.SF_FORMAT_PCM_16,
                  writeNbChannels = 2):
         """ initializes a SndFile object from the file 'file_'. If file_ could be
-        a python file instance or a filename. If file_ is the filename you should
+        a python file instance, a file-like object (io.BytesIO for instance)
+        or a filename. If file_ is the filename you should
         pass the open mode specified in OPEN_MODES. If file_ is a file instance
-        you should call to snd_file_instance.close() prior to close the file with
-        file_.close()"""
+        or a file-like object you should call to snd_file_instance.close()
+        prior to close the file with file_.close().
+        To decode an in-memory buffer without copying it use from_buffer."""
         self._lib = _lib
+        self._dispatch = _dispatch
 
         self._sf_info = SF_INFO()
         if open_mode == OPEN_MODES.SFM_WRITE:
@@ -283,17 +715,62 @@ class SndFile(object):
             self._sf_info.format = writeFormat
             self._sf_info.channels = writeNbChannels
         self.currentPosition = 0
-
-        if isinstance(file_, file):
+        self._virtual_io = None
+        self._open_mode = open_mode
+        self._cache_key = None
+        self._feeder = None
+        # float dtype -> False once set_normalization disabled it
+        self._normalized = {}
+
+        if isinstance(file_, _file_types):
           self._filename = file_.name
           self._SNDFILE = self._lib.sf_open_fd(file_.fileno(), open_mode,
                                                self._sf_info, 0)
+        elif isinstance(file_, _VirtualIO) or hasattr(file_, "seek"):
+          if not isinstance(file_, _VirtualIO):
+              file_ = _FileObjectIO(file_)
+          self._filename = file_.name
+          self._virtual_io = file_
+          self._SNDFILE = self._lib.sf_open_virtual(file_.sf_virtual_io, open_mode,
+                                                    self._sf_info, None)
         else:
           self._filename = file_
-          self._SNDFILE = self._lib.sf_open(self._filename, open_mode, self._sf_info)
-
-        if self._lib.sf_error(self._SNDFILE) != 0:
-            raise Exception(self._lib.sf_strerror(self._SNDFILE))
+          self._SNDFILE = self._lib.sf_open(_encode_path(file_), open_mode, self._sf_info)
+
+        errno = self._lib.sf_error(self._SNDFILE)
+        if errno != 0:
+            raise SndFileError(self._lib.sf_strerror(self._SNDFILE), errno)
+
+    @classmethod
+    def from_buffer(cls, buf):
+        """ opens for reading the audio file contained in buf, any object
+        exposing the buffer protocol (bytes, bytearray, memoryview, mmap...).
+        The data is decoded directly from buf which is never copied, so it
+        must not be modified while the SndFile is open """
+        return cls(_BufferIO(buf))
+
+    @classmethod
+    def from_stream(cls, reader, lookback=1 << 16):
+        """ opens for reading the audio stream read from reader, any object
+        with read(size) such as a pipe (the stdout of a ffmpeg or sox
+        process), socket.makefile("rb") or an HTTP response. The stream is
+        decoded as it's read, with read or blocks, keeping about lookback
+        bytes in memory. The file isn't seekable and nbFrames is the one
+        announced by the header, if any. reader isn't closed by close. """
+        stream = _StreamIO(reader, lookback)
+        if stream.peek(4) == b"OggS":
+            # libsndfile looks for the last page of seekable OGG streams
+            feeder = _PipeFeeder(stream)
+            try:
+                f = cls(feeder.file)
+            except:
+                feeder.close()
+                raise
+            f._feeder = feeder
+            return f
+        f = cls(stream)
+        f._sf_info.seekable = 0
+        return f
 
     @property
     def nbFrames(self):
@@ -315,14 +792,28 @@ class SndFile(object):
     def channels(self):
         """ the number of channels """
         return self._sf_info.channels
+    @property
+    def native_dtype(self):
+        """ the narrowest numpy dtype holding the samples of the file without
+        loss, the one read with dtype="native" (see native_types) """
+        return native_types.get(self.format & FILE_FORMATS.SF_FORMAT_SUBMASK, np.float32)
+    @property
+    def raw_dtype(self):
+        """ the numpy dtype of the samples as stored in an uncompressed file,
+        byte order included, the one read by read_raw. 24 bits samples are
+        3 bytes, their dtype is "V3" """
+        byteorder, kind, itemsize = self._raw_layout()
+        if itemsize == 3:
+            return np.dtype("V3")
+        return np.dtype("%s%s%d" % (byteorder, kind, itemsize))
 
     def __enter__(self):
         return self
 
     def __exit__(self, type, value, traceback):
         if type!=None:
-            print "an exception occured while in the with statement"
-            print value
+            print("an exception occured while in the with statement")
+            print(value)
 
         self.close()
 
@@ -343,32 +834,259 @@ class SndFile(object):
             if self._lib.sf_close(self._SNDFILE) != 0:
                 raise Exception("Can't close file")
             self._SNDFILE = None
+            self._virtual_io = None
+            if self._feeder is not None:
+                self._feeder.close()
+                self._feeder = None
+
+    def command(self, command, data=None, datasize=0):
+        """ sends one of the COMMANDS to libsndfile and returns its result.
+        data is passed as is, use ctypes.byref for the commands expecting a
+        pointer to a value """
+        return self._lib.sf_command(self._SNDFILE, command, data, datasize)
+
+    def memmap(self, mode="r"):
+        """ returns the audio data of an uncompressed file (8, 16, 24 and 32
+        bits PCM, float or double subtypes, in WAV, W64, RF64, AIFF, RAW...
+        containers) as a numpy memmap of dimension (nbFrames, nbChannels),
+        nothing is read until the data is accessed. mode is that of numpy.memmap.
+        Files opened with from_buffer return a view of the buffer instead.
+        24 bits data is returned as a PCM24Map converting it lazily.
+        Raises an exception for other subtypes or files opened from a
+        file-like object."""
+        offset, byteorder, kind, itemsize = self._data_layout()
+        if itemsize == 3:
+            dtype = np.dtype(np.uint8)
+            shape = (self.nbFrames, self.channels, 3)
+        else:
+            dtype = np.dtype("%s%s%d" % (byteorder, kind, itemsize))
+            shape = (self.nbFrames, self.channels)
+        if isinstance(self._virtual_io, _BufferIO):
+            nbBytes = self.nbFrames*self.channels*itemsize
+            raw = self._virtual_io._data[offset:offset+nbBytes]
+            data = raw.view(dtype).reshape(shape)
+        elif self.nbFrames == 0:
+            data = np.empty(shape, dtype)
+        else:
+            data = np.memmap(self._filename, dtype, mode, offset, shape)
+        if itemsize == 3:
+            return PCM24Map(data, byteorder)
+        return data
+
+    def _data_layout(self):
+        """ class internal, returns the byte offset of the first frame, the
+        byte order, numpy kind and size of the samples of an uncompressed file.
+        The offset is the one libsndfile itself seeks to, observed through a
+        second virtual I/O handle """
+        byteorder, kind, itemsize = self._raw_layout()
+        if self._virtual_io is not None and not isinstance(self._virtual_io, _BufferIO):
+            raise Exception("can't map a file opened from a file-like object")
+
+        fileobj = None
+        if isinstance(self._virtual_io, _BufferIO):
+            probe_io = _BufferIO(self._virtual_io._data)
+        else:
+            fileobj = io.open(self._filename, "rb")
+            probe_io = _FileObjectIO(fileobj)
+        try:
+            probe = SndFile(probe_io)
+            try:
+                lastFrame = max(probe.nbFrames - 1, 0)
+                probe.seek(lastFrame)
+                end = probe_io.tell()
+                probe.seek(0)
+                offset = probe_io.tell()
+            finally:
+                probe.close()
+        finally:
+            if fileobj is not None:
+                fileobj.close()
+        if end != offset + lastFrame*itemsize*self.channels:
+            raise Exception("the audio data of %s is not stored contiguously" % self._filename)
+        return offset, byteorder, kind, itemsize
+
+    def _raw_layout(self):
+        """ class internal, returns the byte order, numpy kind and size of the
+        samples of an uncompressed file """
+        subtype = self.format & FILE_FORMATS.SF_FORMAT_SUBMASK
+        major = self.format & FILE_FORMATS.SF_FORMAT_TYPEMASK
+        if major not in _mappable_formats or subtype not in _mappable_subtypes:
+            raise Exception("only uncompressed PCM, float and double data can be mapped")
+        kind, itemsize = _mappable_subtypes[subtype]
+        swap = self.command(COMMANDS.SFC_RAW_DATA_NEEDS_ENDSWAP) == SF_TRUE
+        if (sys.byteorder == "little") != swap:
+            byteorder = "<"
+        else:
+            byteorder = ">"
+        return byteorder, kind, itemsize
+
+    def read_raw(self, nbFrames=None, out=None):
+        """ reads nbFrames (up to the end of the file by default, or as many
+        as out holds) from the current position as stored in the file, without
+        any conversion, with sf_read_raw. The frames beyond the end of the
+        file are filled with 0s. Returns an array of raw_dtype of
+        dimension (nbFrames, nbChannels), or (nbFrames, nbChannels, 3) bytes
+        for 24 bits data (see PCM24Map to convert it), and the number of
+        frames read. Only for uncompressed PCM, float and double data. """
+        byteorder, kind, itemsize = self._raw_layout()
+        frameBytes = itemsize*self.channels
+        if out is None:
+            if nbFrames is None:
+                nbFrames = self.nbFrames - self.seek(0, SEEK_MODES.SEEK_CUR)
+            shape = (nbFrames, self.channels, 3) if itemsize == 3 else (nbFrames, self.channels)
+            out = np.empty(shape, np.uint8 if itemsize == 3 else self.raw_dtype)
+        elif not out.flags.c_contiguous or not out.flags.writeable:
+            raise Exception("the output buffer must be C-contiguous and writable")
+        elif nbFrames is None:
+            nbFrames = out.nbytes//frameBytes
+        if nbFrames*frameBytes > out.nbytes:
+            raise Exception("out can't hold %d frames" % nbFrames)
+        nbBytes = self._lib.sf_read_raw(self._SNDFILE, out.ctypes.data, nbFrames*frameBytes)
+        if nbBytes < 0:
+            raise Exception(self._lib.sf_strerror(self._SNDFILE))
+        nbFramesRead = nbBytes//frameBytes
+        out.reshape(-1).view(np.uint8)[nbFramesRead*frameBytes:nbFrames*frameBytes] = 0
+        return out, nbFramesRead
+
+    def set_normalization(self, normalize, dtype=None):
+        """ sets whether reading or writing floats (dtype float32 or float64,
+        both by default) from or to integer data scales them to [-1, 1], the
+        default, or keeps the integer values (normalize=False) """
+        dtypes = [np.float32, np.float64] if dtype is None else [np.dtype(dtype).type]
+        for dtype in dtypes:
+            if dtype == np.float32:
+                command = COMMANDS.SFC_SET_NORM_FLOAT
+            elif dtype == np.float64:
+                command = COMMANDS.SFC_SET_NORM_DOUBLE
+            else:
+                raise TypeError("only float32 and float64 data is normalized")
+            self.command(command, None, SF_TRUE if normalize else SF_FALSE)
+            self._normalized[dtype] = bool(normalize)
+
+    def _dtype(self, dtype):
+        """ class internal, returns the numpy type of dtype, which may be
+        "native" """
+        if isinstance(dtype, _string_types) and dtype == "native":
+            return self.native_dtype
+        return np.dtype(dtype).type
 
     def write(self, data):
         """ write all the provided data to the file with the parameters
-        specified when opening the file """
-        type_ = data_types_match[data.dtype.type]
-        ctypes_dtype = getattr(ct, "c_" + type_)
-        ctypes_data =  data.ctypes.data_as(ct.POINTER(ctypes_dtype))
-        write_func = getattr(self._lib, "sf_write_" + type_)
-
-        return data, write_func(self._SNDFILE, ctypes_data, data.size)
+        specified when opening the file. Arrays that are not C-contiguous
+        (slices, transposes...) are copied in chunks of about
+        SELECT_CHUNK_BYTES. Returns data and the number of samples written.
+        Use a ctsndfile.writer.StreamWriter to coalesce small writes. """
+        try:
+            pointer_type, read_func, write_func = self._dispatch[data.dtype.type]
+        except KeyError:
+            raise TypeError("unsupported dtype %s" % data.dtype)
+        if data.flags.c_contiguous:
+            ctypes_data = data.ctypes.data_as(pointer_type)
+            return data, write_func(self._SNDFILE, ctypes_data, data.size)
+
+        rows = max(1, SELECT_CHUNK_BYTES//max(data[:1].nbytes, 1))
+        written = 0
+        for start in range(0, len(data), rows):
+            chunk = np.ascontiguousarray(data[start:start + rows])
+            nbWritten = write_func(self._SNDFILE, chunk.ctypes.data_as(pointer_type), chunk.size)
+            written += nbWritten
+            if nbWritten < chunk.size:
+                break
+        return data, written
+
+    def write_sync(self):
+        """ flushes the data written to the disk (fsync) for files opened by
+        name or descriptor """
+        self._lib.sf_write_sync(self._SNDFILE)
+
+    def update_header(self, auto=None):
+        """ rewrites the header of a file opened for writing so it describes
+        the data written so far. If auto is given, the header is (auto=True)
+        or isn't (auto=False) rewritten after every write from now on. """
+        if auto is None:
+            self.command(COMMANDS.SFC_UPDATE_HEADER_NOW)
+        else:
+            self.command(COMMANDS.SFC_SET_UPDATE_HEADER_AUTO, None,
+                         SF_TRUE if auto else SF_FALSE)
 
 
-    def read(self, nbFrames=None, dtype=np.float32):
+    def read(self, nbFrames=None, dtype=np.float32, out=None, channels=None, mix=None):
         """ returns a numpy array of dimension (nbFrames, nbChannels) and of type dtype
-        reads nbFrames for each channels if provided, else reads the entire file
-        the data is read from the current position in the file, this can be set
-        using the seek method.
+        reads nbFrames for each channels if provided, else reads up to the end
+        of the file. The data is read from the current position in the file,
+        this can be set using the seek method.
+        If out is provided the data is decoded directly into it (see readinto)
+        and nbFrames defaults to the number of frames out can hold.
+        Non-seekable files (streams) are read up to their end by blocks.
+        Only the channels listed in channels (indexes) are returned if given,
+        or the frames multiplied by the (nbChannels, nbOutChannels) matrix mix
+        if given. Both decode the file in chunks of about SELECT_CHUNK_BYTES,
+        so the memory used doesn't depend on the number of channels of the file.
         Reading beyond the limits of the file fills the output array with 0s.
-        Accepted dtypes are numpy's int16, int32, float32, float64."""
-        if not nbFrames: nbFrames=self.nbFrames
+        Accepted dtypes are numpy's int8, uint8 (high byte of the samples),
+        int16, int32, float32, float64 and "native", the narrowest of them
+        holding the samples of the file without loss (see native_dtype)."""
+        dtype = self._dtype(dtype)
+        if out is not None:
+            return self._read_out(out, nbFrames, dtype, channels, mix)
+        if not nbFrames and not self.isSeekable:
+            # the length of streams isn't known in advance
+            blocks = [block.copy() for block in
+                      self.blocks(1 << 16, dtype=dtype, channels=channels, mix=mix)]
+            if not blocks:
+                return self._read(0, dtype, channels, mix)
+            data = np.concatenate(blocks)
+            return data, len(data)
+        if not nbFrames:
+            nbFrames = self.nbFrames
+            if self.isSeekable:
+                nbFrames -= self.seek(0, SEEK_MODES.SEEK_CUR)
         try:
-            data, nbFramesRead = self._read(nbFrames, dtype)
-        except TypeError, te:
+            data, nbFramesRead = self._read(nbFrames, dtype, channels, mix)
+        except TypeError as te:
             raise te
         return data, nbFramesRead
 
+    def readinto(self, buf, dtype=np.float32):
+        """ decodes frames from the current position directly into buf and
+        returns the number of frames read. buf can be any C-contiguous writable
+        numpy array of an accepted dtype (see read), for
+        instance buf[i] of a (batch, nbFrames, nbChannels) array, or any object
+        exposing the buffer protocol, which is then interpreted as dtype.
+        buf is filled with as many whole frames as it can hold, interleaved,
+        unread frames are left untouched."""
+        buf = self._as_frames(buf, self._dtype(dtype))
+        return self._read_into(buf, buf.size//self.channels)
+
+    def _as_frames(self, buf, dtype):
+        """ class internal, returns buf as a writable C-contiguous numpy array
+        sharing its memory, raises if that's not possible """
+        if not isinstance(buf, np.ndarray):
+            buf = np.frombuffer(buf, np.dtype(dtype))
+        if buf.dtype.type not in data_types_match and buf.dtype.type not in _narrow_types:
+            raise TypeError("unsupported dtype %s" % buf.dtype)
+        if not buf.flags.c_contiguous or not buf.flags.writeable:
+            raise Exception("the output buffer must be C-contiguous and writable")
+        return buf
+
+    def _read_out(self, out, nbFrames, dtype, channels=None, mix=None):
+        """ class internal common part of read and readFromTo with out """
+        out = self._as_frames(out, dtype)
+        selection = self._selection(channels, mix)
+        width = self.channels if selection is None else selection[1]
+        capacity = out.size//width
+        if nbFrames is None:
+            nbFrames = capacity
+        elif nbFrames > capacity:
+            raise Exception("out can't hold %d frames" % nbFrames)
+        if selection is None:
+            nbFramesRead = self._read_into(out, nbFrames)
+        else:
+            frames = out.reshape(-1)[:nbFrames*width].reshape(-1, width)
+            nbFramesRead = self._read_selected(frames, nbFrames, selection)
+        out.reshape(-1)[nbFramesRead*width:nbFrames*width] = 0
+        return out, nbFramesRead
+
     def seek(self, frame_position, whence=SEEK_MODES.SEEK_SET):
         """ seek to a position in the audio file, seek modes are those
         specified in SEEK_MODES.
@@ -379,32 +1097,222 @@ class SndFile(object):
             raise Exception(self._lib.sf_strerror(self._SNDFILE))
         return offset
 
-    def _read(self, nbFrames, dtype):
+    def _read(self, nbFrames, dtype, channels=None, mix=None):
         """ class internal common part of read and readFromTo """
-        dtype = np.dtype(dtype).type
-        data = np.empty((nbFrames, self.channels), dtype)
-
-        type_ = data_types_match[dtype]
-        ctypes_dtype = getattr(ct, "c_" + type_)
-        ctypes_data =  data.ctypes.data_as(ct.POINTER(ctypes_dtype))
-        read_func = getattr(self._lib, "sf_read_" + type_)
-
-        return data, read_func(self._SNDFILE, ctypes_data, nbFrames*self.channels)/self.channels
+        dtype = self._dtype(dtype)
+        selection = self._selection(channels, mix)
+        if selection is None:
+            data = np.empty((nbFrames, self.channels), dtype)
+            nbFramesRead = self._read_into(data, nbFrames)
+        else:
+            data = np.empty((nbFrames, selection[1]), dtype)
+            nbFramesRead = self._read_selected(data, nbFrames, selection)
+        data[nbFramesRead:] = 0
+        return data, nbFramesRead
 
-    def readFromTo(self, startFrame, stopFrame, dtype=np.float32):
+    def _selection(self, channels, mix):
+        """ class internal, returns None to read every channel, else
+        (kind, number of output channels, channel indexes or mixing matrix) """
+        if channels is not None and mix is not None:
+            raise Exception("channels and mix can't be used together")
+        if channels is not None:
+            channels = np.asarray(channels, np.intp).reshape(-1)
+            if len(channels) == 0 or channels.min() < -self.channels or channels.max() >= self.channels:
+                raise Exception("channels must be indexes of the %d channels" % self.channels)
+            channels %= self.channels
+            if np.array_equal(channels, np.arange(self.channels)):
+                return None
+            return ("channels", len(channels), channels)
+        if mix is not None:
+            mix = np.asarray(mix, np.float64)
+            if mix.ndim == 1:
+                mix = mix[:, None]
+            if mix.ndim != 2 or mix.shape[0] != self.channels:
+                raise Exception("mix must be a (%d, nbOutChannels) matrix" % self.channels)
+            return ("mix", mix.shape[1], mix)
+        return None
+
+    def _read_selected(self, frames, nbFrames, selection, scratch=None):
+        """ class internal, decodes nbFrames from the current position in
+        chunks of about SELECT_CHUNK_BYTES (into scratch if given) and stores
+        the channels selected or mixed in the C-contiguous (nbFrames,
+        nbOutChannels) array frames, returns the number of frames read """
+        kind, width, selection = selection
+        dtype = frames.dtype
+        if scratch is None:
+            chunk = max(1, SELECT_CHUNK_BYTES//(self.channels*dtype.itemsize))
+            scratch = np.empty((min(chunk, nbFrames), self.channels), dtype)
+        chunk = len(scratch)
+        integer = dtype.kind in "iu"
+        if kind == "mix" and not integer:
+            selection = selection.astype(dtype)
+        position = 0
+        while position < nbFrames:
+            wanted = min(chunk, nbFrames - position)
+            nbFramesRead = self._read_into(scratch, wanted)
+            if nbFramesRead <= 0:
+                break
+            decoded = scratch[:nbFramesRead]
+            target = frames[position:position + nbFramesRead]
+            if kind == "channels":
+                np.take(decoded, selection, axis=1, out=target)
+            elif integer:
+                info = np.iinfo(dtype)
+                mixed = np.rint(np.dot(decoded, selection))
+                target[...] = np.clip(mixed, info.min, info.max)
+            else:
+                np.dot(decoded, selection, out=target)
+            position += nbFramesRead
+            if nbFramesRead < wanted:
+                break
+        return position
+
+    def _read_into(self, data, nbFrames):
+        """ class internal, decodes nbFrames from the current position into
+        the C-contiguous array data and returns the number of frames read """
+        if self.block_cache is not None and self._cacheable():
+            return self._read_cached(data, nbFrames)
+        return self._decode_into(data, nbFrames)
+
+    def _cacheable(self):
+        """ class internal, True if the blocks of this file can be cached """
+        if self._cache_key is None:
+            if (self._virtual_io is not None or not self.isSeekable
+                    or self._open_mode != OPEN_MODES.SFM_READ):
+                self._cache_key = False
+            else:
+                stat = os.stat(self._filename)
+                self._cache_key = (os.path.abspath(self._filename), stat.st_mtime,
+                                   stat.st_size)
+        return self._cache_key is not False
+
+    def _read_cached(self, data, nbFrames):
+        """ class internal, _read_into copying the frames from the cached blocks """
+        cache = self.block_cache
+        blocksize = cache.blocksize
+        frames = data.reshape(-1)[:nbFrames*self.channels].reshape(-1, self.channels)
+        start = self.seek(0, SEEK_MODES.SEEK_CUR)
+        stop = min(start + nbFrames, self.nbFrames)
+        position = start
+        while position < stop:
+            index = position//blocksize
+            key = self._cache_key + (data.dtype.str, self._normalized.get(data.dtype.type, True),
+                                     index)
+            block = cache.get(key)
+            if block is None:
+                block = np.empty((blocksize, self.channels), data.dtype)
+                self.seek(index*blocksize)
+                nbFramesRead = self._decode_into(block, blocksize)
+                if nbFramesRead < blocksize:
+                    # a view would keep the whole block alive, uncounted
+                    block = block[:nbFramesRead].copy()
+                cache.put(key, block)
+            end = min(stop, index*blocksize + len(block))
+            if end <= position:
+                break
+            frames[position-start:end-start] = block[position-index*blocksize:end-index*blocksize]
+            position = end
+        self.seek(position)
+        return position - start
+
+    def _decode_into(self, data, nbFrames):
+        """ class internal, _read_into calling libsndfile """
+        if data.dtype.type in _narrow_types:
+            return self._decode_narrow(data, nbFrames)
+        try:
+            pointer_type, read_func, write_func = self._dispatch[data.dtype.type]
+        except KeyError:
+            raise TypeError("unsupported dtype %s" % data.dtype)
+        ctypes_data = data.ctypes.data_as(pointer_type)
+        return read_func(self._SNDFILE, ctypes_data, nbFrames*self.channels)//self.channels
+
+    def _decode_narrow(self, data, nbFrames):
+        """ class internal, _decode_into for the 8 bits dtypes, decoding int16
+        chunks of about SELECT_CHUNK_BYTES """
+        offset = _narrow_types[data.dtype.type]
+        frames = data.reshape(-1)[:nbFrames*self.channels].reshape(-1, self.channels)
+        chunk = max(1, SELECT_CHUNK_BYTES//(2*self.channels))
+        scratch = np.empty((min(chunk, nbFrames), self.channels), np.int16)
+        position = 0
+        while position < nbFrames:
+            wanted = min(chunk, nbFrames - position)
+            nbFramesRead = self._decode_into(scratch, wanted)
+            if nbFramesRead <= 0:
+                break
+            decoded = scratch[:nbFramesRead]
+            np.right_shift(decoded, 8, out=decoded)
+            if offset:
+                decoded += offset
+            frames[position:position + nbFramesRead] = decoded
+            position += nbFramesRead
+            if nbFramesRead < wanted:
+                break
+        return position
+
+    def blocks(self, blocksize, overlap=0, dtype=np.float32, out=None, pad=False,
+               channels=None, mix=None):
+        """ generator reading the file from the current position in blocks of
+        blocksize frames, each block being a (blocksize, nbChannels) view of a
+        single buffer allocated once (or of out if provided, which must be a
+        C-contiguous array of that shape). The yielded views are overwritten by
+        the next iteration, copy them if you need to keep them.
+        Consecutive blocks share overlap frames (the hop is blocksize-overlap).
+        The last block is shorter unless pad is True, then it is zero padded.
+        channels and mix select or mix the channels of the blocks as in read.
+        Accepted dtypes are those of read."""
+        if blocksize <= 0 or not 0 <= overlap < blocksize:
+            raise Exception("Please choose blocksize > overlap >= 0")
+        selection = self._selection(channels, mix)
+        width = self.channels if selection is None else selection[1]
+        if out is None:
+            out = np.empty((blocksize, width), self._dtype(dtype))
+        elif out.shape != (blocksize, width) or not out.flags.c_contiguous:
+            raise Exception("out must be a C-contiguous array of shape (%d, %d)"
+                            % (blocksize, width))
+        hop = blocksize - overlap
+        if selection is None:
+            read = self._read_into
+        else:
+            chunk = max(1, SELECT_CHUNK_BYTES//(self.channels*out.dtype.itemsize))
+            scratch = np.empty((min(chunk, blocksize), self.channels), out.dtype)
+            read = lambda frames, nbFrames: self._read_selected(frames, nbFrames,
+                                                                selection, scratch)
+
+        valid = read(out, blocksize)
+        while valid > 0:
+            if valid < blocksize:
+                if pad:
+                    out[valid:] = 0
+                    yield out
+                else:
+                    yield out[:valid]
+                return
+            yield out
+            if overlap:
+                out[:overlap] = out[hop:]
+            nbFramesRead = read(out[overlap:], hop)
+            valid = overlap + nbFramesRead if nbFramesRead else 0
+
+    def readFromTo(self, startFrame, stopFrame, dtype=np.float32, out=None,
+                   channels=None, mix=None):
         """ helper read method to specify the start and ending frame of reading.
         Raises an exception if startFrame<0 or stopFrame<startFrame.
         Accepted dtypes are numpy's int16, int32, float32, float64.
         returns a numpy array of dimension (stopFrame-startFrame, nbChannels)
-        and the number of frames actually read.
+        and the number of frames actually read. If out is provided the data is
+        decoded directly into it and out is returned (see readinto).
+        channels and mix select or mix the channels as in read.
         Reading beyond the limits of the file fills the output array with 0s."""
         if stopFrame<=startFrame and startFrame>=0:
             raise Exception("Please choose stopFrame > startFrame >= 0")
         nbFrames = stopFrame-startFrame
         self.seek(startFrame)
+        dtype = self._dtype(dtype)
+        if out is not None:
+            return self._read_out(out, nbFrames, dtype, channels, mix)
         try:
-            data, nbFramesRead = self._read(nbFrames, dtype)
-        except TypeError, te:
+            data, nbFramesRead = self._read(nbFrames, dtype, channels, mix)
+        except TypeError as te:
             raise te
         return data, nbFramesRead
 
@@ -420,10 +1328,10 @@ class SndFile(object):
 if __name__=="__main__":
     with SndFile("test/LS100673.WAV") as f:
         #print various information
-        print f
+        print(f)
         #read from 1 to 3 seconds
         data, nbFramesRead = f.readFromTo(1*f.samplerate, 3*f.samplerate, dtype=np.float64)
-        print "nb frames read:",nbFramesRead
+        print("nb frames read:", nbFramesRead)
 
         #get the left channel
         lChannel = data[:,0]
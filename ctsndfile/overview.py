@@ -0,0 +1,235 @@
+"""
+Multi-resolution min/max/RMS overviews of audio files, for waveform displays.
+
+build_overview decodes a file once and computes, for every channel, the
+minimum, maximum and RMS of its frames in buckets of several sizes (the
+levels). The result is saved in a binary sidecar, memory-mapped when loaded,
+so get_overview answers zooms and scrolls by reading a few buckets of a
+single level without decoding the audio again:
+
+    mins, maxs, rms = get_overview("speech.flac", 0, 48000*60, width=1200)
+"""
+
+import hashlib
+import os
+import struct
+
+import numpy as np
+
+from ctsndfile.libsndfile import SndFile
+
+# bucket sizes in frames, each one a multiple of the previous one
+DEFAULT_LEVELS = (256, 1024, 4096, 16384, 65536)
+
+OVERVIEW_MAGIC = b"SFOVERVW"
+OVERVIEW_VERSION = 1
+
+# magic, version, channels, samplerate, number of levels, frames, size and
+# mtime of the file, length of its path, then the levels and the path
+_HEADER = struct.Struct("<8sIIIIqqdI")
+_LEVEL = struct.Struct("<q")
+_ALIGN = 16
+
+
+def overview_filename(path, cache_dir=None):
+    """ returns where the overview of path is stored: a .sfov sidecar next to
+    it, or a file named after the hash of its absolute path in cache_dir """
+    if cache_dir is None:
+        return path + ".sfov"
+    key = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, key + ".sfov")
+
+
+def _buckets(frames, factor):
+    """ returns the min, max and sum of squares (float64) of the channels of
+    frames in buckets of factor frames, the last one possibly shorter """
+    nbFull = len(frames)//factor
+    full = frames[:nbFull*factor].reshape(nbFull, factor, -1)
+    mins = full.min(axis=1)
+    maxs = full.max(axis=1)
+    squares = np.einsum("ijk,ijk->ik", full, full, dtype=np.float64)
+    if nbFull*factor < len(frames):
+        tail = frames[nbFull*factor:]
+        mins = np.vstack((mins, tail.min(axis=0)))
+        maxs = np.vstack((maxs, tail.max(axis=0)))
+        squares = np.vstack((squares, np.einsum("ij,ij->j", tail, tail, dtype=np.float64)))
+    return mins, maxs, squares
+
+
+def _merge(mins, maxs, squares, ratio):
+    """ returns the statistics of buckets ratio times larger """
+    channels = mins.shape[1]
+    return (mins.reshape(-1, ratio, channels).min(axis=1),
+            maxs.reshape(-1, ratio, channels).max(axis=1),
+            squares.reshape(-1, ratio, channels).sum(axis=1))
+
+
+class Overview(object):
+    """ the min/max/RMS of the frames of a file in buckets of each of the
+    levels bucket sizes. levels[i] is a (nbBuckets, 3, nbChannels) float32
+    array of the min, max and RMS of each bucket, the last bucket of each level
+    covering the remaining frames. """
+
+    def __init__(self, path, size, mtime, nbFrames, channels, samplerate,
+                 factors, levels):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.nbFrames = nbFrames
+        self.channels = channels
+        self.samplerate = samplerate
+        self.factors = tuple(factors)
+        self.levels = levels
+
+    @classmethod
+    def build(cls, path, filename, factors=DEFAULT_LEVELS):
+        """ decodes path once, writes its overview to filename and returns it """
+        factors = sorted(factors)
+        if factors[0] <= 0 or any(b % a for a, b in zip(factors, factors[1:])):
+            raise Exception("each level must be a positive multiple of the previous one")
+        stat = os.stat(path)
+        f = SndFile(path)
+        try:
+            nbFrames, channels, samplerate = f.nbFrames, f.channels, f.samplerate
+            tmp = filename + ".part"
+            offsets = cls._write_header(tmp, path, stat.st_size, stat.st_mtime, nbFrames,
+                                        channels, samplerate, factors)
+            levels = [cls._map(tmp, "r+", offset, nbFrames, factor, channels)
+                      for factor, offset in zip(factors, offsets)]
+
+            # blocks of whole buckets of every level, except the last one
+            largest = factors[-1]
+            blocksize = largest*max(1, (1 << 18)//largest)
+            position = 0
+            for block in f.blocks(blocksize, dtype=np.float32):
+                stats = None
+                for i, factor in enumerate(factors):
+                    if len(block) == blocksize and stats is not None:
+                        stats = _merge(*(stats + (factor//factors[i-1],)))
+                    else:
+                        stats = _buckets(block, factor)
+                    first = position//factor
+                    level = levels[i][first:first + len(stats[0])]
+                    level[:, 0] = stats[0]
+                    level[:, 1] = stats[1]
+                    counts = np.minimum(factor, len(block) - factor*np.arange(len(stats[0])))
+                    level[:, 2] = np.sqrt(stats[2]/counts[:, None])
+                position += len(block)
+            for level in levels:
+                if isinstance(level, np.memmap):
+                    level.flush()
+            del levels
+        finally:
+            f.close()
+        os.rename(tmp, filename)
+        return cls.load(filename)
+
+    @staticmethod
+    def _write_header(filename, path, size, mtime, nbFrames, channels, samplerate, factors):
+        """ creates filename with the header of an overview and room for its
+        levels, returns the offsets of the levels """
+        encoded = path.encode("utf-8") if not isinstance(path, bytes) else path
+        header = (_HEADER.pack(OVERVIEW_MAGIC, OVERVIEW_VERSION, channels, samplerate,
+                               len(factors), nbFrames, size, mtime, len(encoded))
+                  + b"".join(_LEVEL.pack(factor) for factor in factors) + encoded)
+        header += b"\0"*(-len(header) % _ALIGN)
+        offsets = []
+        end = len(header)
+        for factor in factors:
+            offsets.append(end)
+            end += -(-nbFrames//factor)*3*channels*4
+        with open(filename, "wb") as f:
+            f.write(header)
+            f.truncate(end)
+        return offsets
+
+    @staticmethod
+    def _map(filename, mode, offset, nbFrames, factor, channels):
+        shape = (-(-nbFrames//factor), 3, channels)
+        if shape[0] == 0:
+            return np.zeros(shape, np.float32)
+        return np.memmap(filename, np.dtype("<f4"), mode, offset, shape)
+
+    @classmethod
+    def load(cls, filename):
+        """ returns the overview saved in filename, its levels memory mapped """
+        with open(filename, "rb") as f:
+            header = f.read(_HEADER.size)
+            (magic, version, channels, samplerate, nbLevels, nbFrames, size, mtime,
+             pathLength) = _HEADER.unpack(header)
+            if magic != OVERVIEW_MAGIC or version != OVERVIEW_VERSION:
+                raise Exception("%s is not an overview of version %d"
+                                % (filename, OVERVIEW_VERSION))
+            factors = [_LEVEL.unpack(f.read(_LEVEL.size))[0] for _ in range(nbLevels)]
+            path = f.read(pathLength).decode("utf-8")
+        offset = _HEADER.size + nbLevels*_LEVEL.size + pathLength
+        offset += -offset % _ALIGN
+        levels = []
+        for factor in factors:
+            levels.append(cls._map(filename, "r", offset, nbFrames, factor, channels))
+            offset += levels[-1].nbytes
+        return cls(path, size, mtime, nbFrames, channels, samplerate, factors, levels)
+
+    def is_valid(self):
+        """ True if the file didn't change since the overview was built """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return stat.st_size == self.size and stat.st_mtime == self.mtime
+
+    def query(self, start, stop, width):
+        """ returns the min, max and RMS of the frames start to stop split in
+        width pixels, three (width, nbChannels) float32 arrays, computed from
+        the coarsest level having at least one bucket per pixel, so start and
+        stop are rounded to the buckets of that level. If even the finest
+        level is too coarse the frames are decoded. """
+        stop = min(stop, self.nbFrames)
+        if width <= 0 or not 0 <= start < stop:
+            raise Exception("Please choose width > 0 and nbFrames >= stop > start >= 0")
+        frames_per_pixel = float(stop - start)/width
+        usable = [i for i, factor in enumerate(self.factors) if factor <= frames_per_pixel]
+        if not usable:
+            with SndFile(self.path) as f:
+                frames = f.readFromTo(start, stop)[0]
+            return _pixels(frames, frames, np.abs(frames), np.ones(len(frames)), width)
+        factor = self.factors[usable[-1]]
+        level = self.levels[usable[-1]]
+        first, last = start//factor, -(-stop//factor)
+        buckets = np.asarray(level[first:last])
+        counts = np.minimum(factor, self.nbFrames - factor*np.arange(first, last))
+        return _pixels(buckets[:, 0], buckets[:, 1], buckets[:, 2], counts, width)
+
+
+def _pixels(mins, maxs, rms, counts, width):
+    """ returns the min, max and RMS of buckets grouped in width pixels """
+    nbBuckets = len(mins)
+    if nbBuckets < width:
+        index = np.arange(width)*nbBuckets//width
+        return mins[index], maxs[index], rms[index].astype(np.float32)
+    edges = np.arange(width)*nbBuckets//width
+    squares = np.add.reduceat(rms.astype(np.float64)**2*counts[:, None], edges)
+    return (np.minimum.reduceat(mins, edges), np.maximum.reduceat(maxs, edges),
+            np.sqrt(squares/np.add.reduceat(counts, edges)[:, None]).astype(np.float32))
+
+
+def build_overview(path, levels=DEFAULT_LEVELS, cache_dir=None):
+    """ decodes path once and saves its overview at levels bucket sizes (see
+    overview_filename), returns the Overview """
+    return Overview.build(path, overview_filename(path, cache_dir), levels)
+
+
+def get_overview(path, start, stop, width, cache_dir=None, levels=DEFAULT_LEVELS):
+    """ returns the min, max and RMS of the frames start to stop of path in
+    width pixels (see Overview.query), from its saved overview if it's still
+    valid, else the overview is built first """
+    filename = overview_filename(path, cache_dir)
+    try:
+        overview = Overview.load(filename)
+        if overview.path != path or not overview.is_valid():
+            overview = None
+    except Exception:
+        overview = None
+    if overview is None:
+        overview = Overview.build(path, filename, levels)
+    return overview.query(start, stop, width)
@@ -0,0 +1,146 @@
+"""
+Background prefetching of the blocks of a SndFile.
+
+A PrefetchReader decodes the next blocks on a thread (libsndfile is called
+without holding the GIL) while the consumer works on the current one:
+
+    with PrefetchReader(SndFile("speech.flac"), 4096, depth=4) as reader:
+        for block in reader:
+            process(block)
+"""
+
+import threading
+import time
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+import numpy as np
+
+_END = object()
+
+
+class PrefetchReader(object):
+    """ reads sndfile from its current position in blocks of blocksize frames,
+    decoding up to depth blocks ahead on a background thread into a ring of
+    depth+1 buffers allocated once. Blocks are (blocksize, nbChannels) views
+    of the ring, the last one is shorter unless pad is True. A block stays
+    valid until the next one is asked for, copy it if you need to keep it.
+    The decoder waits when depth blocks are ready and not consumed yet.
+    sndfile must not be used by anyone else until the reader is closed, it's
+    left open by close. """
+
+    def __init__(self, sndfile, blocksize, depth=2, dtype=np.float32, pad=False):
+        if blocksize <= 0 or depth <= 0:
+            raise Exception("Please choose blocksize > 0 and depth > 0")
+        self.sndfile = sndfile
+        self.blocksize = blocksize
+        self.depth = depth
+        self.pad = pad
+        self._ring = np.empty((depth + 1, blocksize, sndfile.channels), sndfile._dtype(dtype))
+        self._free = Queue()
+        for slot in range(depth + 1):
+            self._free.put(slot)
+        self._ready = Queue()
+        self._current = None
+        self._done = False
+        self._closed = False
+        self.reset_stats()
+        self._thread = threading.Thread(target=self._decode, name="PrefetchReader")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _decode(self):
+        """ class internal, body of the decoding thread """
+        try:
+            while True:
+                start = time.time()
+                slot = self._free.get()
+                self._stall_seconds += time.time() - start
+                if self._closed:
+                    return
+                start = time.time()
+                valid = self.sndfile._read_into(self._ring[slot], self.blocksize)
+                self._decode_seconds += time.time() - start
+                if valid <= 0:
+                    break
+                self._ready.put((slot, valid))
+                if valid < self.blocksize:
+                    break
+        except Exception as e:
+            self._ready.put((_END, e))
+            return
+        self._ready.put((_END, None))
+
+    def next_block(self):
+        """ returns the next block, or None at the end of the file. Raises the
+        exception the decoder stopped on, if any. """
+        if self._current is not None:
+            self._free.put(self._current)
+            self._current = None
+        if self._done or self._closed:
+            return None
+        if self._ready.empty():
+            self._underruns += 1
+            start = time.time()
+            slot, valid = self._ready.get()
+            self._wait_seconds += time.time() - start
+        else:
+            slot, valid = self._ready.get()
+        if slot is _END:
+            self._done = True
+            if valid is not None:
+                raise valid
+            return None
+        self._current = slot
+        self._blocks += 1
+        self._frames += valid
+        block = self._ring[slot]
+        if valid < self.blocksize:
+            if not self.pad:
+                return block[:valid]
+            block[valid:] = 0
+        return block
+
+    def __iter__(self):
+        while True:
+            block = self.next_block()
+            if block is None:
+                return
+            yield block
+
+    def stats(self):
+        """ returns the number of blocks and frames delivered, the number of
+        underruns (a block was asked for before it was decoded) and the time
+        the consumer waited on them, the time spent decoding and the time the
+        decoder waited on the consumer (backpressure) """
+        return {"blocks": self._blocks,
+                "frames": self._frames,
+                "underruns": self._underruns,
+                "wait_seconds": self._wait_seconds,
+                "decode_seconds": self._decode_seconds,
+                "stall_seconds": self._stall_seconds}
+
+    def reset_stats(self):
+        self._blocks = 0
+        self._frames = 0
+        self._underruns = 0
+        self._wait_seconds = 0.
+        self._decode_seconds = 0.
+        self._stall_seconds = 0.
+
+    def close(self):
+        """ stops the decoding thread, the blocks not consumed are dropped """
+        if self._closed:
+            return
+        self._closed = True
+        # wakes the decoder up if it waits for a free buffer
+        self._free.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
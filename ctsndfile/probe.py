@@ -0,0 +1,142 @@
+"""
+Fast metadata probing and a persistent, incremental index of directories.
+"""
+
+import os
+import sqlite3
+import sys
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+from ctsndfile.libsndfile import (_lib, _encode_path, SF_INFO, OPEN_MODES, FILE_STRINGS,
+                                  SndFileError)
+
+
+# FILE_STRINGS names without their SF_STR_ prefix, in the order of their values
+STRING_NAMES = tuple(name[len("SF_STR_"):].lower() for value, name in
+                     sorted((value, name) for name, value in vars(FILE_STRINGS).items()
+                            if name.startswith("SF_STR_")))
+
+_INFO_FIELDS = ("frames", "samplerate", "channels", "format", "sections", "seekable")
+
+AudioInfo = namedtuple("AudioInfo", ("path",) + _INFO_FIELDS + STRING_NAMES)
+
+
+def probe(path):
+    """ returns an AudioInfo with the SF_INFO fields and the strings (None if
+    missing) of the file path, which is only opened to read its header.
+    Raises a SndFileError if libsndfile can't open it. """
+    sf_info = SF_INFO()
+    sndfile = _lib.sf_open(_encode_path(path), OPEN_MODES.SFM_READ, sf_info)
+    errno = _lib.sf_error(sndfile)
+    if errno != 0:
+        raise SndFileError(_lib.sf_strerror(sndfile), errno)
+    try:
+        strings = tuple(_lib.sf_get_string(sndfile, getattr(FILE_STRINGS, "SF_STR_" + name.upper()))
+                        for name in STRING_NAMES)
+    finally:
+        _lib.sf_close(sndfile)
+    return AudioInfo(path, *(tuple(getattr(sf_info, field) for field in _INFO_FIELDS) + strings))
+
+
+def _probe_entry(entry):
+    path, size, mtime = entry
+    try:
+        return entry, probe(path), None
+    except Exception as e:
+        # stored as the error of the file, not to stop the other files
+        return entry, None, str(e)
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    return value
+
+
+def _connect(index_path):
+    db = sqlite3.connect(index_path)
+    columns = ", ".join("%s %s" % (name, "TEXT" if name in STRING_NAMES else "INTEGER")
+                        for name in _INFO_FIELDS + STRING_NAMES)
+    db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, "
+               "mtime REAL, error TEXT, %s)" % columns)
+    return db
+
+
+def index_directory(root, index_path=None, workers=None, extensions=None):
+    """ probes every file under root on workers threads (one per cpu by
+    default) and stores the results in the SQLite database index_path
+    (root/.sndindex.sqlite by default). Files whose size and mtime didn't
+    change since the last run aren't probed again and files that disappeared
+    are removed. Only the files ending with one of extensions (".wav",
+    ".flac"...) are considered if given. Files libsndfile can't open are
+    stored with their error. Returns the number of files probed, skipped,
+    removed and of errors. """
+    if isinstance(root, bytes):
+        # walked as text, sqlite only stores text paths
+        root = root.decode(sys.getfilesystemencoding() or "utf-8")
+    if index_path is None:
+        index_path = os.path.join(root, ".sndindex.sqlite")
+    if extensions is not None:
+        extensions = tuple(extension.lower() for extension in extensions)
+    index_path = os.path.abspath(index_path)
+
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if os.path.abspath(path) == index_path:
+                continue
+            if extensions is not None and not filename.lower().endswith(extensions):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+
+    db = _connect(index_path)
+    try:
+        known = dict((path, (size, mtime)) for path, size, mtime
+                     in db.execute("SELECT path, size, mtime FROM files"))
+        todo = [entry for entry in entries if known.get(_text(entry[0])) != entry[1:]]
+        removed = set(known) - set(_text(entry[0]) for entry in entries)
+
+        columns = ("path", "size", "mtime", "error") + _INFO_FIELDS + STRING_NAMES
+        insert = "INSERT OR REPLACE INTO files (%s) VALUES (%s)" % (
+            ", ".join(columns), ", ".join("?"*len(columns)))
+        nbErrors = 0
+        pool = ThreadPool(workers)
+        try:
+            for entry, info, error in pool.imap_unordered(_probe_entry, todo, chunksize=16):
+                # the names the filesystem encoding can't decode are still bytes
+                entry = (_text(entry[0]),) + entry[1:]
+                if info is None:
+                    nbErrors += 1
+                    values = entry + (error,) + (None,)*(len(_INFO_FIELDS) + len(STRING_NAMES))
+                else:
+                    values = (entry + (None,) + info[1:1+len(_INFO_FIELDS)]
+                              + tuple(_text(value) for value in info[1+len(_INFO_FIELDS):]))
+                db.execute(insert, values)
+        finally:
+            pool.terminate()
+            pool.join()
+        db.executemany("DELETE FROM files WHERE path = ?", [(removedPath,) for removedPath in removed])
+        db.commit()
+    finally:
+        db.close()
+    return {"probed": len(todo), "skipped": len(entries) - len(todo),
+            "removed": len(removed), "errors": nbErrors}
+
+
+def read_index(index_path):
+    """ returns a dict mapping the paths of an index written by
+    index_directory to their AudioInfo, files that couldn't be opened are
+    left out """
+    db = _connect(index_path)
+    try:
+        rows = db.execute("SELECT path, %s FROM files WHERE error IS NULL"
+                          % ", ".join(_INFO_FIELDS + STRING_NAMES)).fetchall()
+    finally:
+        db.close()
+    return dict((row[0], AudioInfo(*row)) for row in rows)
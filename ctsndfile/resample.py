@@ -0,0 +1,306 @@
+"""
+Streaming resampling, downmixing and dtype conversion of audio files.
+
+A NormalizedSndFile reads a SndFile block by block, mixes its channels down
+(or up) while decoding, resamples the frames with a polyphase filter that
+keeps its state from one block to the next, and converts them to the dtype
+asked for, so files of any length are normalized in constant memory:
+
+    with SndFile("interview.flac") as f:
+        speech = NormalizedSndFile(f, samplerate=16000, channels=1)
+        for block in speech.blocks(4096):
+            process(block)
+
+normalize_file chains it directly into a SndFile opened for writing.
+"""
+
+try:
+    from math import gcd
+except ImportError:
+    from fractions import gcd
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from ctsndfile.libsndfile import SndFile, OPEN_MODES, FILE_FORMATS, data_types_match
+
+
+def polyphase_filter(up, down, taps=32, beta=8.6, rolloff=0.945):
+    """ returns the polyphase decomposition of the Kaiser windowed sinc
+    lowpass filter resampling by up/down, its cutoff being rolloff times the
+    lower of the two Nyquist frequencies and its length taps periods of the
+    lower samplerate. It's an array of shape (up, taps per phase), each phase
+    having a DC gain of 1. """
+    taps = -(-taps*max(up, down)//up)
+    length = up*taps
+    center = length//2
+    cutoff = rolloff*0.5/max(up, down)
+    j = np.arange(length) - center
+    h = 2*cutoff*np.sinc(2*cutoff*j)*np.kaiser(2*center + 1, beta)[:length]
+    h *= up/h.sum()
+    return h.reshape(taps, up).T.copy()
+
+
+class Resampler(object):
+    """ resamples blocks of frames from src_rate to dst_rate, the ratio being
+    reduced to up/down, with a polyphase filter spanning taps periods of the
+    lower samplerate (see polyphase_filter). The last frames of each block are
+    kept to compute the output frames of the next one, so feeding a signal in
+    blocks of any size gives the same output as feeding it at once. Output
+    frame n is the signal at input frame n*down/up, ceil(nbFrames*up/down)
+    frames are output in all once flush is called. Computes in dtype (float32
+    or float64). """
+
+    def __init__(self, src_rate, dst_rate, channels, taps=32, beta=8.6, dtype=np.float32):
+        if src_rate <= 0 or dst_rate <= 0 or taps <= 0:
+            raise Exception("Please choose src_rate > 0, dst_rate > 0 and taps > 0")
+        divisor = gcd(int(src_rate), int(dst_rate))
+        self.up = int(dst_rate)//divisor
+        self.down = int(src_rate)//divisor
+        self.channels = channels
+        self.dtype = np.dtype(dtype).type
+        bank = polyphase_filter(self.up, self.down, taps, beta)
+        self.taps = bank.shape[1]
+        # reversed, to be applied to windows of increasing frames
+        self._filter = bank[:, ::-1].astype(self.dtype)
+        # upsampled frames between an output frame and the center of its filter
+        self._delay = (self.up*self.taps)//2
+        self.reset()
+
+    def reset(self):
+        """ forgets the frames given so far """
+        # the input frames from _base on, starting with the zeros before the signal
+        self._buffer = np.zeros((self.taps, self.channels), self.dtype)
+        self._base = -self.taps
+        self._consumed = 0
+        self._next = 0
+        self._flushed = False
+
+    def output_frames(self, nbFrames):
+        """ returns the number of frames output for nbFrames input frames """
+        return -(-nbFrames*self.up//self.down)
+
+    def process(self, frames):
+        """ returns the frames resampled from frames, an array of shape
+        (nbFrames, channels), as far as the filter can compute them """
+        if self._flushed:
+            raise Exception("the resampler was flushed, reset it first")
+        frames = np.asarray(frames, self.dtype)
+        if frames.ndim == 1 and self.channels == 1:
+            frames = frames[:, None]
+        if frames.ndim != 2 or frames.shape[1] != self.channels:
+            raise Exception("frames must be of shape (nbFrames, %d)" % self.channels)
+        self._buffer = np.concatenate((self._buffer, frames))
+        self._consumed += len(frames)
+        # output frame n needs the input frame (n*down + delay)//up
+        stop = -(-(self._consumed*self.up - self._delay)//self.down)
+        return self._compute(max(stop, self._next))
+
+    def flush(self):
+        """ returns the last frames, computed with zeros after the signal """
+        if self._flushed:
+            return np.empty((0, self.channels), self.dtype)
+        stop = self.output_frames(self._consumed)
+        last = ((stop - 1)*self.down + self._delay)//self.up
+        missing = last + 1 - (self._base + len(self._buffer))
+        if missing > 0:
+            self._buffer = np.concatenate(
+                (self._buffer, np.zeros((missing, self.channels), self.dtype)))
+        out = self._compute(max(stop, self._next))
+        self._flushed = True
+        return out
+
+    def _compute(self, stop):
+        """ class internal, returns the output frames _next to stop and drops
+        the input frames no longer needed. The output frames n, n+up, n+2*up...
+        share a phase and their windows start down frames apart, so each phase
+        is a product with a strided view of the buffer, without copies. """
+        out = np.empty((stop - self._next, self.channels), self.dtype)
+        rowStride, channelStride = self._buffer.strides
+        for offset in range(min(self.up, len(out))):
+            upsampled = (self._next + offset)*self.down + self._delay
+            first = upsampled//self.up - (self.taps - 1) - self._base
+            count = len(out[offset::self.up])
+            windows = as_strided(self._buffer[first:], (count, self.taps, self.channels),
+                                 (self.down*rowStride, rowStride, channelStride))
+            np.einsum("nkc,k->nc", windows, self._filter[upsampled % self.up],
+                      out=out[offset::self.up])
+        self._next = stop
+        first = (self._next*self.down + self._delay)//self.up - (self.taps - 1)
+        if first > self._base:
+            self._buffer = self._buffer[first - self._base:].copy()
+            self._base = first
+        return out
+
+
+def mix_matrix(src_channels, dst_channels):
+    """ returns the (src_channels, dst_channels) matrix mixing src_channels
+    channels into dst_channels: the average for mono, copies of a mono
+    channel, None if they are the same """
+    if src_channels == dst_channels:
+        return None
+    if dst_channels == 1:
+        return np.full((src_channels, 1), 1./src_channels)
+    if src_channels == 1:
+        return np.ones((1, dst_channels))
+    raise Exception("can't mix %d channels into %d, give a mix matrix"
+                    % (src_channels, dst_channels))
+
+
+class NormalizedSndFile(object):
+    """ sndfile read from its current position at samplerate (that of sndfile
+    by default), with channels channels (mixed as in mix_matrix, or by mix, a
+    (sndfile.channels, channels) matrix) and of dtype, one of data_types_match.
+    Frames are read in blocks of blocksize input frames, mixed while decoded,
+    resampled by a Resampler and converted to dtype, integer dtypes being
+    scaled to their full range and clipped. read and blocks continue from where
+    the previous call stopped. sndfile must not be used by anyone else while
+    it's read, it's left open by close. """
+
+    def __init__(self, sndfile, samplerate=None, channels=None, dtype=np.float32,
+                 mix=None, taps=32, blocksize=1 << 16):
+        dtype = np.dtype(dtype).type
+        if dtype not in data_types_match:
+            raise TypeError("unsupported dtype %s" % np.dtype(dtype))
+        self.sndfile = sndfile
+        self.samplerate = samplerate or sndfile.samplerate
+        self.dtype = dtype
+        if mix is not None:
+            self._mix = np.asarray(mix, np.float64).reshape(sndfile.channels, -1)
+        else:
+            self._mix = mix_matrix(sndfile.channels, channels or sndfile.channels)
+        self.channels = sndfile.channels if self._mix is None else self._mix.shape[1]
+        # decoded as floats, in double precision when float32 would lose bits
+        if dtype in (np.float64, np.int32):
+            self._work = np.float64
+        else:
+            self._work = np.float32
+        if self.samplerate == sndfile.samplerate:
+            self.resampler = None
+        else:
+            self.resampler = Resampler(sndfile.samplerate, self.samplerate, self.channels,
+                                       taps, dtype=self._work)
+        self.blocksize = blocksize
+        self._source = None
+        self._pending = None
+        self._offset = 0
+
+    @property
+    def nbFrames(self):
+        """ the number of frames of the whole file once normalized """
+        if self.resampler is None:
+            return self.sndfile.nbFrames
+        return self.resampler.output_frames(self.sndfile.nbFrames)
+
+    def _produce(self):
+        """ class internal, generator of the normalized frames, in chunks """
+        for block in self.sndfile.blocks(self.blocksize, dtype=self._work, mix=self._mix):
+            if self.resampler is not None:
+                block = self.resampler.process(block)
+            yield self._convert(block)
+        if self.resampler is not None:
+            yield self._convert(self.resampler.flush())
+
+    def _convert(self, frames):
+        """ class internal, returns frames as dtype """
+        if self.dtype in (np.float32, np.float64):
+            return frames.astype(self.dtype, copy=False)
+        info = np.iinfo(self.dtype)
+        scaled = np.rint(frames*(float(info.max) + 1))
+        return np.clip(scaled, info.min, info.max, out=scaled).astype(self.dtype)
+
+    def _fill(self, frames, nbFrames):
+        """ class internal, copies the next nbFrames normalized frames (or
+        less at the end of the file) into frames, returns how many """
+        if self._source is None:
+            self._source = self._produce()
+        filled = 0
+        while filled < nbFrames:
+            if self._pending is None or self._offset == len(self._pending):
+                self._pending = next(self._source, None)
+                self._offset = 0
+                if self._pending is None:
+                    break
+            count = min(nbFrames - filled, len(self._pending) - self._offset)
+            frames[filled:filled + count] = self._pending[self._offset:self._offset + count]
+            filled += count
+            self._offset += count
+        return filled
+
+    def read(self, nbFrames=None, out=None):
+        """ same as SndFile.read of the normalized frames, reads up to the end
+        of the file by default (or as many frames as out holds) """
+        if out is not None:
+            if out.ndim != 2 or out.shape[1] != self.channels or out.dtype != self.dtype:
+                raise Exception("out must be of shape (nbFrames, %d) and dtype %s"
+                                % (self.channels, np.dtype(self.dtype)))
+            if nbFrames is None:
+                nbFrames = len(out)
+            elif nbFrames > len(out):
+                raise Exception("out can't hold %d frames" % nbFrames)
+        elif nbFrames is None:
+            data = np.concatenate([block.copy() for block in self.blocks(1 << 16)]
+                                  or [np.empty((0, self.channels), self.dtype)])
+            return data, len(data)
+        else:
+            out = np.empty((nbFrames, self.channels), self.dtype)
+        nbFramesRead = self._fill(out, nbFrames)
+        out[nbFramesRead:nbFrames] = 0
+        return out, nbFramesRead
+
+    def blocks(self, blocksize, out=None, pad=False):
+        """ same as SndFile.blocks of the normalized frames, without overlap """
+        if blocksize <= 0:
+            raise Exception("Please choose blocksize > 0")
+        if out is None:
+            out = np.empty((blocksize, self.channels), self.dtype)
+        elif out.shape != (blocksize, self.channels) or out.dtype != self.dtype:
+            raise Exception("out must be an array of shape (%d, %d) and dtype %s"
+                            % (blocksize, self.channels, np.dtype(self.dtype)))
+        while True:
+            nbFramesRead = self._fill(out, blocksize)
+            if nbFramesRead == blocksize:
+                yield out
+                continue
+            if nbFramesRead and pad:
+                out[nbFramesRead:] = 0
+                yield out
+            elif nbFramesRead:
+                yield out[:nbFramesRead]
+            return
+
+    def close(self):
+        """ stops reading, sndfile is left open """
+        self._source = None
+        self._pending = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+def normalize_file(src, dst, samplerate=16000, channels=1, dtype=np.float32,
+                   writeFormat=FILE_FORMATS.SF_FORMAT_WAV|FILE_FORMATS.SF_FORMAT_FLOAT,
+                   blocksize=1 << 16):
+    """ writes src normalized to samplerate, channels and dtype (see
+    NormalizedSndFile) into dst, in writeFormat. Returns the number of frames
+    written. """
+    source = SndFile(src)
+    try:
+        normalized = NormalizedSndFile(source, samplerate, channels, dtype,
+                                       blocksize=blocksize)
+        destination = SndFile(dst, OPEN_MODES.SFM_WRITE, writeSamplerate=samplerate,
+                              writeFormat=writeFormat, writeNbChannels=normalized.channels)
+        try:
+            nbFrames = 0
+            for block in normalized.blocks(blocksize):
+                if destination.write(block)[1] != block.size:
+                    raise Exception("can't write %s" % dst)
+                nbFrames += len(block)
+        finally:
+            destination.close()
+        return nbFrames
+    finally:
+        source.close()
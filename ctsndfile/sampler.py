@@ -0,0 +1,161 @@
+"""
+Random fixed-length windows across many audio files, batched for training.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from ctsndfile.libsndfile import SndFile
+
+
+class _HandlePool(object):
+    """ class internal, keeps at most max_open idle handles open, closing the
+    least recently used ones first. A handle is used by one caller at a time. """
+
+    def __init__(self, opener, max_open):
+        self._opener = opener
+        self._max_open = max_open
+        self._idle = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, path):
+        with self._lock:
+            handle = self._idle.pop(path, None)
+        if handle is None:
+            handle = self._opener(path)
+        return handle
+
+    def release(self, path, handle):
+        with self._lock:
+            self._idle[path] = handle
+            while len(self._idle) > self._max_open:
+                self._idle.popitem(last=False)[1].close()
+
+    def close(self):
+        with self._lock:
+            while self._idle:
+                self._idle.popitem()[1].close()
+
+
+class WindowSampler(object):
+    """ draws batches of batch_size random windows of window_frames frames
+    from the files in paths, each window being equally likely (so files are
+    weighted by their number of frames, files shorter than a window are never
+    drawn). All the files must have the same number of channels.
+    Windows are decoded directly into one (batch_size, window_frames,
+    nbChannels) array allocated once. At most max_open files are kept open,
+    opened with opener (SndFile, or IndexedSndFile for frame accurate
+    OGG/Vorbis windows, which seeking with libsndfile isn't).
+    If max_workers is given, the files of a batch are read on that many threads.
+    """
+
+    def __init__(self, paths, window_frames, batch_size, dtype=np.float32,
+                 max_open=64, max_workers=None, opener=SndFile, seed=None):
+        self.paths = list(paths)
+        self.window_frames = window_frames
+        self.batch_size = batch_size
+        self.dtype = np.dtype(dtype).type
+
+        nbFrames = np.zeros(len(self.paths), np.int64)
+        self.channels = None
+        for i, path in enumerate(self.paths):
+            f = opener(path)
+            nbFrames[i] = f.nbFrames
+            if self.channels is None:
+                self.channels = f.channels
+            elif f.channels != self.channels:
+                raise Exception("%s has %d channels, expected %d"
+                                % (path, f.channels, self.channels))
+            f.close()
+        self.nbFrames = nbFrames
+        # number of windows starting in each file, cumulated
+        self._windows = np.cumsum(np.maximum(nbFrames - window_frames + 1, 0))
+        if len(self._windows) == 0 or self._windows[-1] == 0:
+            raise Exception("no file is at least %d frames long" % window_frames)
+
+        self._random = np.random.RandomState(seed)
+        self._handles = _HandlePool(opener, max_open)
+        self._pool = ThreadPool(max_workers) if max_workers else None
+        self._buffer = np.empty((batch_size, window_frames, self.channels), self.dtype)
+        self.reset_stats()
+
+    def draw(self, n):
+        """ returns the file indexes and start frames of n random windows """
+        draws = self._random.randint(0, self._windows[-1], n)
+        files = np.searchsorted(self._windows, draws, side="right")
+        offsets = draws - np.concatenate(([0], self._windows))[files]
+        return files, offsets
+
+    def next_batch(self, out=None):
+        """ returns a batch of random windows, the file indexes and the start
+        frames of each window. The batch is written in an array reused by
+        every call (or in out if given) so it's overwritten by the next one. """
+        start = time.time()
+        if out is None:
+            out = self._buffer
+        elif out.shape != self._buffer.shape or not out.flags.c_contiguous:
+            raise Exception("out must be a C-contiguous array of shape (%d, %d, %d)"
+                            % self._buffer.shape)
+        files, offsets = self.draw(len(out))
+
+        # one job per file so a handle is never shared between threads
+        order = np.argsort(files, kind="mergesort")
+        jobs = []
+        for index in np.unique(files):
+            rows = order[files[order] == index]
+            jobs.append((self.paths[index], [(row, offsets[row]) for row in rows], out))
+        if self._pool is None:
+            for job in jobs:
+                self._read_windows(job)
+        else:
+            self._pool.map(self._read_windows, jobs, chunksize=1)
+
+        self._batches += 1
+        self._nbWindows += len(out)
+        self._seconds += time.time() - start
+        return out, files, offsets
+
+    def _read_windows(self, job):
+        path, windows, out = job
+        handle = self._handles.acquire(path)
+        try:
+            for row, offset in windows:
+                handle.readFromTo(offset, offset + self.window_frames, out=out[row])
+        finally:
+            self._handles.release(path, handle)
+
+    def __iter__(self):
+        while True:
+            yield self.next_batch()
+
+    def stats(self):
+        """ returns the number of batches and windows drawn, the time spent in
+        next_batch and the resulting windows and frames per second """
+        seconds = self._seconds or float("nan")
+        return {"batches": self._batches,
+                "windows": self._nbWindows,
+                "seconds": self._seconds,
+                "windows_per_second": self._nbWindows/seconds,
+                "frames_per_second": self._nbWindows*self.window_frames/seconds}
+
+    def reset_stats(self):
+        self._batches = 0
+        self._nbWindows = 0
+        self._seconds = 0.
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        self._handles.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
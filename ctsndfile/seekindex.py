@@ -0,0 +1,333 @@
+"""
+Frame accurate seek index for OGG/Vorbis files.
+
+A sparse table of checkpoints (first frame decoded, byte offset of an OGG
+page) is built in one pass over the file structure and saved in a sidecar
+file (or a cache directory) keyed by the path, size and mtime of the audio
+file.
+IndexedSndFile uses it to read random windows of OGG/Vorbis files frame
+accurately, which seeking with libsndfile isn't, at about the cost of a
+libsndfile seek: a single decoder is given the stream headers followed by
+the bytes of the file from the checkpoint before the window, and restarted
+there instead of searching the file for the window. FLAC files need no
+index, libsndfile already seeks them frame accurately and as fast.
+"""
+
+import hashlib
+import io
+import json
+import os
+import struct
+from bisect import bisect_right
+
+import ctypes as ct
+import numpy as np
+
+from ctsndfile.libsndfile import SndFile, _VirtualIO, SEEK_MODES, FILE_FORMATS
+
+INDEX_VERSION = 1
+
+# default distance in frames between two checkpoints, at most that many
+# frames are decoded and dropped before the first frame requested
+DEFAULT_INTERVAL = 1 << 13
+
+_OGG_EOS = 0x04
+
+
+def _ogg_pages(fileobj):
+    """ yields (byte offset, granule position, size, header type) of each
+    page of an OGG file """
+    offset = 0
+    while True:
+        header = fileobj.read(27)
+        if len(header) < 27:
+            return
+        if header[:4] != b"OggS":
+            raise Exception("lost OGG page synchronisation at byte %d" % offset)
+        granule = struct.unpack("<q", header[6:14])[0]
+        headerType = bytearray(header)[5]
+        nbSegments = bytearray(header)[26]
+        size = 27 + nbSegments + sum(bytearray(fileobj.read(nbSegments)))
+        yield offset, granule, size, headerType
+        offset += size
+        fileobj.seek(offset)
+
+
+def _ogg_checkpoints(fileobj, interval):
+    """ returns the size of the OGG/Vorbis headers and the checkpoints of the
+    stream. The first frame decoded from a page depends on the packets around
+    it, so each checkpoint is calibrated by decoding the page up to the next
+    page ending a packet and subtracting the frames produced from its granule """
+    pages = list(_ogg_pages(fileobj))
+    audio = [i for i, page in enumerate(pages) if page[1] != 0]
+    if not audio:
+        return fileobj.tell(), [(0, fileobj.tell())]
+    header_size = pages[audio[0]][0]
+    fileobj.seek(0)
+    header = fileobj.read(header_size)
+
+    checkpoints = [(0, header_size)]
+    previous = 0
+    for k in range(audio[0] + 1, len(pages)):
+        if pages[k-1][1] < 0 or pages[k-1][1] - previous < interval:
+            continue
+        m = k
+        while m < len(pages) and pages[m][1] < 0:
+            m += 1
+        # the granule of the last page is where the stream ends once trimmed,
+        # not where its decoded frames end
+        if m == len(pages) or pages[m][3] & _OGG_EOS:
+            break
+        fileobj.seek(pages[k][0])
+        body = fileobj.read(pages[m][0] + pages[m][2] - pages[k][0])
+        f = SndFile.from_buffer(header + body)
+        try:
+            nbFrames = 0
+            for block in f.blocks(1 << 14):
+                nbFrames += len(block)
+        finally:
+            f.close()
+        checkpoints.append((pages[m][1] - nbFrames, pages[k][0]))
+        previous = pages[k-1][1]
+    return header_size, checkpoints
+
+
+class SeekIndex(object):
+    """ sparse frame -> byte offset table of an OGG/Vorbis file """
+
+    def __init__(self, path, size, mtime, header_size, checkpoints):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.header_size = header_size
+        self.checkpoints = checkpoints
+        self._frames = [frame for frame, offset in checkpoints]
+
+    @classmethod
+    def build(cls, path, interval=DEFAULT_INTERVAL):
+        """ builds the index of the file path in one pass, a checkpoint every
+        interval frames (roughly). Raises an exception for other formats. """
+        f = SndFile(path)
+        major = f.format & FILE_FORMATS.SF_FORMAT_TYPEMASK
+        f.close()
+        if major != FILE_FORMATS.SF_FORMAT_OGG:
+            raise Exception("seek indexes are only supported for OGG files")
+        stat = os.stat(path)
+        with io.open(path, "rb") as fileobj:
+            header_size, checkpoints = _ogg_checkpoints(fileobj, interval)
+        return cls(path, stat.st_size, stat.st_mtime, header_size, checkpoints)
+
+    def is_valid(self):
+        """ True if the indexed file wasn't modified since the index was built """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return stat.st_size == self.size and stat.st_mtime == self.mtime
+
+    def lookup(self, frame):
+        """ returns (first frame, byte offset) of the last checkpoint before frame """
+        return self.checkpoints[max(bisect_right(self._frames, frame) - 1, 0)]
+
+    def save(self, filename):
+        with open(filename, "w") as f:
+            json.dump({"version": INDEX_VERSION, "path": self.path,
+                       "size": self.size, "mtime": self.mtime,
+                       "header_size": self.header_size,
+                       "checkpoints": self.checkpoints}, f)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as f:
+            data = json.load(f)
+        if data.get("version") != INDEX_VERSION:
+            raise Exception("unsupported seek index version")
+        return cls(data["path"], data["size"], data["mtime"], data["header_size"],
+                   [tuple(checkpoint) for checkpoint in data["checkpoints"]])
+
+
+def index_filename(path, cache_dir=None):
+    """ returns where the index of path is stored: a .sfidx sidecar next to it,
+    or a file named after the hash of its absolute path in cache_dir """
+    if cache_dir is None:
+        return path + ".sfidx"
+    key = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, key + ".sfidx")
+
+
+def get_index(path, cache_dir=None, interval=DEFAULT_INTERVAL):
+    """ returns the persisted index of path if it's still valid, else builds
+    and saves it. Failing to save the index isn't an error. """
+    filename = index_filename(path, cache_dir)
+    try:
+        index = SeekIndex.load(filename)
+        if index.path == path and index.is_valid():
+            return index
+    except Exception:
+        pass
+    index = SeekIndex.build(path, interval)
+    try:
+        index.save(filename)
+    except EnvironmentError:
+        pass
+    return index
+
+
+class _SpliceIO(_VirtualIO):
+    """ class internal, read only virtual I/O presenting the first header_size
+    bytes of fileobj followed by its contents from offset on """
+
+    def __init__(self, fileobj, header, offset):
+        _VirtualIO.__init__(self)
+        self._fileobj = fileobj
+        self._header = header
+        fileobj.seek(0, SEEK_MODES.SEEK_END)
+        self._size = fileobj.tell()
+        self.move(offset)
+        self._position = 0
+        self.name = getattr(fileobj, "name", "<spliced>")
+
+    def move(self, offset):
+        """ makes the bytes after the header those of fileobj from offset on """
+        self._offset = offset
+        self._length = len(self._header) + self._size - offset
+
+    def get_filelen(self):
+        return self._length
+
+    def seek(self, offset, whence):
+        if whence == SEEK_MODES.SEEK_CUR:
+            offset += self._position
+        elif whence == SEEK_MODES.SEEK_END:
+            offset += self._length
+        if offset < 0:
+            return -1
+        self._position = offset
+        return offset
+
+    def read(self, ptr, count):
+        count = max(0, min(count, self._length - self._position))
+        done = 0
+        if self._position < len(self._header):
+            done = min(count, len(self._header) - self._position)
+            ct.memmove(ptr, self._header[self._position:self._position+done], done)
+        if done < count:
+            self._fileobj.seek(self._offset + self._position + done - len(self._header))
+            buf = (ct.c_char*(count - done)).from_address(ptr + done)
+            done += self._fileobj.readinto(buf) or 0
+        self._position += done
+        return done
+
+    def write(self, ptr, count):
+        return 0
+
+    def tell(self):
+        return self._position
+
+
+class IndexedSndFile(SndFile):
+    """ SndFile whose readFromTo returns frame accurate windows of OGG/Vorbis
+    files by decoding from the checkpoint of a SeekIndex closest to
+    startFrame instead of seeking. The decoder keeps decoding for the next
+    window if no checkpoint is closer, and is restarted at the checkpoint of
+    the window else. The index is loaded or built with get_index (cache_dir
+    and interval are passed to it). Like SndFile.readFromTo, it leaves the
+    file where the window stopped for the next read. Other files, FLAC
+    included, are read as by SndFile. """
+
+    def __init__(self, path, cache_dir=None, interval=DEFAULT_INTERVAL):
+        SndFile.__init__(self, path)
+        self.seek_index = None
+        major = self.format & FILE_FORMATS.SF_FORMAT_TYPEMASK
+        if major == FILE_FORMATS.SF_FORMAT_OGG:
+            self.seek_index = get_index(path, cache_dir, interval)
+            self._fileobj = io.open(path, "rb")
+            self._header = self._fileobj.read(self.seek_index.header_size)
+        self._splice = None
+        self._spliced = None
+        # first frame decoded since the last restart, and the next one
+        self._splicedStart = None
+        self._splicedPosition = None
+        self._scratch = None
+        # where the last window stopped, the file is moved there when used
+        self._pending = None
+
+    def readFromTo(self, startFrame, stopFrame, dtype=np.float32, out=None,
+                   channels=None, mix=None):
+        """ same as SndFile.readFromTo, using the seek index if there is one """
+        if self.seek_index is None:
+            return SndFile.readFromTo(self, startFrame, stopFrame, dtype, out, channels, mix)
+        if stopFrame<=startFrame and startFrame>=0:
+            raise Exception("Please choose stopFrame > startFrame >= 0")
+        if self._spliced is None:
+            self._splice = _SpliceIO(self._fileobj, self._header, self.seek_index.header_size)
+            self._spliced = SndFile(self._splice)
+            self._splicedStart = self._splicedPosition = 0
+            self._scratch = np.empty((1 << 14, self.channels), np.float32)
+        checkpoint = self.seek_index.lookup(startFrame)
+        # restarting costs less than decoding up to the checkpoint
+        if self._splicedPosition > startFrame or self._splicedPosition < checkpoint[0]:
+            self._restart(checkpoint)
+
+        skip = startFrame - self._splicedPosition
+        # libsndfile skips the packets before the window faster than they're
+        # decoded, but only lands on the right frame seeking from a restart
+        if skip > 0 and self._splicedPosition == self._splicedStart == checkpoint[0]:
+            self._spliced.seek(skip, SEEK_MODES.SEEK_CUR)
+            self._splicedPosition = startFrame
+            skip = 0
+        while skip > 0:
+            nbFramesRead = self._spliced._read_into(self._scratch, min(skip, len(self._scratch)))
+            if nbFramesRead == 0:
+                break
+            skip -= nbFramesRead
+            self._splicedPosition += nbFramesRead
+
+        nbFrames = stopFrame - startFrame
+        if out is not None:
+            data, nbFramesRead = self._spliced._read_out(out, nbFrames, dtype, channels, mix)
+        else:
+            data, nbFramesRead = self._spliced._read(nbFrames, dtype, channels, mix)
+        self._splicedPosition += nbFramesRead
+        self._pending = min(startFrame + nbFramesRead, self.nbFrames)
+        return data, nbFramesRead
+
+    def _sync(self):
+        """ class internal, moves the file to where the last window stopped,
+        only once it's used not to pay a libsndfile seek per window """
+        if self._pending is not None:
+            position, self._pending = self._pending, None
+            SndFile.seek(self, position)
+
+    def seek(self, frame_position, whence=SEEK_MODES.SEEK_SET):
+        self._sync()
+        return SndFile.seek(self, frame_position, whence)
+
+    def read_raw(self, nbFrames=None, out=None):
+        self._sync()
+        return SndFile.read_raw(self, nbFrames, out)
+
+    def _read_into(self, data, nbFrames):
+        self._sync()
+        return SndFile._read_into(self, data, nbFrames)
+
+    def _restart(self, checkpoint):
+        """ class internal, restarts decoding at checkpoint: the splice is
+        moved to its offset and libsndfile seeks back to the first frame,
+        which resets the decoder without parsing the stream headers again """
+        # libsndfile doesn't seek to where it already is, its buffers would
+        # still hold pages from the previous offset
+        if self._splicedPosition == self._splicedStart:
+            self._splicedPosition += self._spliced._read_into(self._scratch, 1)
+        frame, offset = checkpoint
+        self._splice.move(offset)
+        self._spliced.seek(0)
+        self._splicedStart = self._splicedPosition = frame
+
+    def close(self):
+        if self._spliced is not None:
+            self._spliced.close()
+            self._spliced = None
+        if self.seek_index is not None:
+            self._fileobj.close()
+        SndFile.close(self)
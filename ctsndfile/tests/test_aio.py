@@ -0,0 +1,98 @@
+"""
+Tests of ctsndfile.aio, kept apart from tests.py since they need Python 3:
+
+    python3 -m unittest ctsndfile.tests.test_aio
+"""
+
+import os
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from ctsndfile.libsndfile import SndFile
+try:
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from ctsndfile.aio import AsyncSndFile
+except ImportError:
+    asyncio = None
+
+CURR_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@unittest.skipIf(asyncio is None, "asyncio requires Python 3")
+class TestAsyncSndFile(unittest.TestCase):
+
+    test_filename = os.path.join(CURR_DIR, "test.wav")
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def test_read_from_to(self):
+        f = self.loop.run_until_complete(AsyncSndFile.open(self.test_filename))
+        data, nbFramesRead = self.loop.run_until_complete(
+            f.read_from_to(100, 1100, dtype=np.int16))
+        self.loop.run_until_complete(f.close())
+        with SndFile(self.test_filename) as f:
+            expected = f.readFromTo(100, 1100, dtype=np.int16)[0]
+        self.assertEqual(nbFramesRead, 1000)
+        self.assertTrue(np.array_equal(data, expected))
+
+    def test_calls_on_a_busy_file_wait_on_the_loop(self):
+        class SlowFile(object):
+            running = 0
+            calls = 0
+            def __init__(self, delay):
+                self.delay = delay
+                self.lock = threading.Lock()
+            def seek(self, frame_position, whence):
+                with self.lock:
+                    self.running += 1
+                    self.concurrent = self.running > 1
+                time.sleep(self.delay)
+                with self.lock:
+                    self.running -= 1
+                    self.calls += 1
+                return frame_position
+        class TwoWorkers(AsyncSndFile):
+            executor = ThreadPoolExecutor(2)
+        busy, free = SlowFile(0.05), SlowFile(0)
+        busyFile, freeFile = TwoWorkers(busy), TwoWorkers(free)
+        pending = [busyFile.seek(i) for i in range(6)]
+        self.loop.run_until_complete(freeFile.seek(0))
+        # the free file only waited for a worker, not for the busy file's queue
+        self.assertTrue(busy.calls <= 1)
+        self.assertEqual(self.loop.run_until_complete(asyncio.gather(*pending)),
+                         list(range(6)))
+        self.assertFalse(busy.concurrent)
+        TwoWorkers.executor.shutdown()
+
+    def test_max_open(self):
+        class TwoFiles(AsyncSndFile):
+            max_open = 2
+        AsyncSndFile._limit = None
+        try:
+            first = self.loop.run_until_complete(TwoFiles.open(self.test_filename))
+            second = self.loop.run_until_complete(TwoFiles.open(self.test_filename))
+            # wrapped directly, doesn't count and doesn't free a slot when closed
+            self.loop.run_until_complete(TwoFiles(SndFile(self.test_filename)).close())
+            third = TwoFiles.open(self.test_filename)
+            self.loop.run_until_complete(asyncio.sleep(0.05))
+            self.assertFalse(third.done())
+            self.loop.run_until_complete(first.close())
+            third = self.loop.run_until_complete(third)
+            for f in (second, third):
+                self.loop.run_until_complete(f.close())
+        finally:
+            AsyncSndFile._limit = None
+
+
+if __name__=="__main__":
+    unittest.main()
@@ -1,9 +1,29 @@
+from __future__ import print_function
+
+import io
+import mmap
 import os
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
 
 import numpy as np
 
-from ctsndfile.libsndfile import SndFile, OPEN_MODES, FILE_FORMATS
+from ctsndfile.libsndfile import SndFile, SndFileError, OPEN_MODES, FILE_FORMATS, SEEK_MODES
+from ctsndfile.batch import read_many, read_padded
+from ctsndfile.seekindex import IndexedSndFile, get_index, index_filename
+from ctsndfile.sampler import WindowSampler
+from ctsndfile.cache import BlockCache
+from ctsndfile.probe import probe, index_directory, read_index
+from ctsndfile.prefetch import PrefetchReader
+from ctsndfile.writer import StreamWriter
+from ctsndfile.transcode import transcode
+from ctsndfile.overview import build_overview, get_overview, overview_filename
+from ctsndfile.fileset import SndFileSet
+from ctsndfile.resample import Resampler, NormalizedSndFile, normalize_file
+from ctsndfile import benchmark, instrument
 
 CURR_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -82,14 +102,782 @@ class TestSndFile(unittest.TestCase):
         g.close()
         _g.close()
 
+    def test_blocks(self):
+        f = SndFile(self.test_filename)
+        data, n_samples = f.read(dtype=np.float64)
+        f.seek(0)
+        blocks = [b.copy() for b in f.blocks(1000, dtype=np.float64)]
+        f.close()
+        self.assertEqual(len(blocks[-1]), n_samples % 1000)
+        self.assertTrue(np.all(np.concatenate(blocks) == data))
+
+    def test_blocks_overlap_pad(self):
+        f = SndFile(self.test_filename)
+        data, n_samples = f.read(dtype=np.float64)
+        f.seek(0)
+        buf = np.empty((1024, 1), np.float64)
+        for i, block in enumerate(f.blocks(1024, overlap=256, out=buf, pad=True)):
+            self.assertTrue(block is buf)
+            start = i*768
+            stop = min(start + 1024, n_samples)
+            self.assertTrue(np.all(block[:stop-start] == data[start:stop]))
+            self.assertTrue(np.all(block[stop-start:] == 0))
+        f.close()
+        self.assertEqual(i, (n_samples - 256 - 1)//768)
+
+    def test_readinto(self):
+        f = SndFile(self.test_filename)
+        data, n_samples = f.read(dtype=np.int16)
+        f.seek(0)
+        batch = np.zeros((2, 1000, 1), np.int16)
+        self.assertEqual(f.readinto(batch[1]), 1000)
+        self.assertTrue(np.all(batch[1] == data[:1000]))
+        self.assertTrue(np.all(batch[0] == 0))
+
+        buf = bytearray(400)
+        self.assertEqual(f.readinto(buf, dtype=np.float32), 100)
+        f.close()
+
+    def test_read_out(self):
+        f = SndFile(self.test_filename)
+        data, n_samples = f.read(dtype=np.float32)
+        out = np.empty((500, 1), np.float32)
+        res, n = f.readFromTo(n_samples - 100, n_samples + 400, out=out)
+        self.assertTrue(res is out)
+        self.assertEqual(n, 100)
+        self.assertTrue(np.all(out[:100] == data[-100:]))
+        self.assertTrue(np.all(out[100:] == 0))
+        f.seek(0)
+        res, n = f.read(out=out)
+        self.assertEqual(n, 500)
+        self.assertRaises(TypeError, f.read, out=np.empty((10, 1), np.int64))
+        self.assertRaises(Exception, f.read, out=np.empty((10, 2), np.float32)[:, 0])
+        f.close()
+
+    def test_from_buffer(self):
+        f = SndFile(self.test_filename)
+        data, n_samples = f.read(dtype=np.float64)
+        f.close()
+
+        with open(self.test_filename, "rb") as _f:
+            contents = _f.read()
+        f = SndFile.from_buffer(memoryview(contents))
+        self.assertEqual(f.samplerate, 8000)
+        data2, n_samples2 = f.read(dtype=np.float64)
+        f.close()
+        self.assertEqual(n_samples, n_samples2)
+        self.assertTrue(np.all(data == data2))
+
+    def test_write_bytesio(self):
+        f = SndFile(self.test_filename)
+        data, n_samples = f.read(dtype=np.int16)
+        f.close()
+
+        buf = io.BytesIO()
+        g = SndFile(buf, open_mode=OPEN_MODES.SFM_WRITE,
+                    writeSamplerate=8000,
+                    writeFormat=FILE_FORMATS.SF_FORMAT_WAV|FILE_FORMATS.SF_FORMAT_PCM_16,
+                    writeNbChannels=1)
+        g.write(data)
+        g.close()
+
+        buf.seek(0)
+        f = SndFile(buf)
+        data2, n_samples2 = f.read(dtype=np.int16)
+        f.close()
+        self.assertEqual(n_samples, n_samples2)
+        self.assertTrue(np.all(data == data2))
+
+    def test_memmap(self):
+        f = SndFile(self.test_filename)
+        data, n_samples = f.read(dtype=np.int16)
+        mapped = f.memmap()
+        f.close()
+        self.assertEqual(mapped.shape, (n_samples, 1))
+        self.assertTrue(np.all(mapped == data))
+
+        with open(self.test_filename, "rb") as _f:
+            f = SndFile.from_buffer(_f.read())
+        self.assertTrue(np.all(f.memmap() == data))
+        f.close()
+
+        with open(self.test_filename, "rb") as _f:
+            mapping = mmap.mmap(_f.fileno(), 0, access=mmap.ACCESS_READ)
+        f = SndFile.from_buffer(mapping)
+        self.assertTrue(np.all(f.read(dtype=np.int16)[0] == data))
+        f.close()
+
+    def test_memmap_pcm24(self):
+        fd, filename = tempfile.mkstemp(suffix=".aiff")
+        os.close(fd)
+        data = (np.arange(-3000, 3000, dtype=np.int32) << 16).reshape(-1, 2)
+        try:
+            f = SndFile(filename, open_mode=OPEN_MODES.SFM_WRITE,
+                        writeFormat=FILE_FORMATS.SF_FORMAT_AIFF|FILE_FORMATS.SF_FORMAT_PCM_24)
+            f.write(data)
+            f.close()
+
+            f = SndFile(filename)
+            mapped = f.memmap()
+            f.close()
+            self.assertEqual(mapped.shape, data.shape)
+            self.assertTrue(np.all(mapped[10:20] == data[10:20]))
+            self.assertTrue(np.all(np.concatenate(list(mapped.blocks(1000))) == data))
+        finally:
+            os.remove(filename)
+
+    def test_select_channels(self):
+        fd, filename = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        data = np.arange(4000*4, dtype=np.int16).reshape(-1, 4)
+        try:
+            f = SndFile(filename, open_mode=OPEN_MODES.SFM_WRITE, writeNbChannels=4)
+            f.write(data)
+            f.close()
+
+            f = SndFile(filename)
+            selected, nbFramesRead = f.read(dtype=np.int16, channels=[3, 1])
+            self.assertEqual(nbFramesRead, 4000)
+            self.assertTrue(np.all(selected == data[:, [3, 1]]))
+            f.seek(0)
+            blocks = [block.copy() for block in f.blocks(300, dtype=np.int16, channels=[2])]
+            self.assertTrue(np.all(np.concatenate(blocks) == data[:, 2:3]))
+            mixed = f.readFromTo(100, 200, dtype=np.float64, mix=[0.5, 0.5, 0, 0])[0]
+            frames = f.readFromTo(100, 200, dtype=np.float64)[0]
+            f.close()
+            self.assertEqual(mixed.shape, (100, 1))
+            self.assertTrue(np.allclose(mixed[:, 0], frames[:, :2].mean(axis=1)))
+        finally:
+            os.remove(filename)
+
+    def test_from_stream(self):
+        class Reader(object):
+            def __init__(self, data):
+                self.read = io.BytesIO(data).read
+        with open(self.test_filename, "rb") as _f:
+            wav = _f.read()
+        with SndFile(self.test_filename) as f:
+            expected = f.read(dtype=np.int16)[0]
+        f = SndFile.from_stream(Reader(wav), lookback=1024)
+        self.assertFalse(f.isSeekable)
+        blocks = [block.copy() for block in f.blocks(1000, dtype=np.int16)]
+        f.close()
+        self.assertTrue(np.all(np.concatenate(blocks) == expected))
+
+        fd, filename = tempfile.mkstemp(suffix=".ogg")
+        os.close(fd)
+        try:
+            f = SndFile(filename, open_mode=OPEN_MODES.SFM_WRITE, writeNbChannels=1,
+                        writeFormat=FILE_FORMATS.SF_FORMAT_OGG|FILE_FORMATS.SF_FORMAT_VORBIS)
+            f.write(expected.astype(np.float32)/32768)
+            f.close()
+            with open(filename, "rb") as _f:
+                f = SndFile.from_stream(Reader(_f.read()))
+            data, nbFramesRead = f.read()
+            f.close()
+            self.assertEqual(nbFramesRead, len(expected))
+        finally:
+            os.remove(filename)
+
+    def test_lazy_library(self):
+        script = ("import ctsndfile.libsndfile as l\n"
+                  "try:\n"
+                  "    l.SndFile(%r)\n"
+                  "except OSError:\n"
+                  "    print('missing')\n" % self.test_filename)
+        env = dict(os.environ, CTSNDFILE_LIBRARY=os.path.join(CURR_DIR, "missing.so"))
+        output = subprocess.check_output([sys.executable, "-c", script], env=env,
+                                         cwd=os.path.dirname(os.path.dirname(CURR_DIR)))
+        self.assertEqual(output.strip(), b"missing")
+
+    def test_native_and_raw(self):
+        fd, filename = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        data = (np.arange(1000*2).reshape(-1, 2)*32 - 32000).astype(np.int16)
+        try:
+            f = SndFile(filename, open_mode=OPEN_MODES.SFM_WRITE, writeNbChannels=2,
+                        writeFormat=FILE_FORMATS.SF_FORMAT_WAV|FILE_FORMATS.SF_FORMAT_PCM_U8)
+            f.write(data)
+            f.close()
+
+            f = SndFile(filename)
+            self.assertEqual(f.native_dtype, np.uint8)
+            native, nbFramesRead = f.read(dtype="native")
+            self.assertEqual(native.dtype, np.uint8)
+            self.assertTrue(np.all(native == (data >> 8) + 128))
+            raw = f.readFromTo(0, 1000, dtype="native")[0]
+            self.assertTrue(np.all(raw == native))
+            f.seek(0)
+            raw, nbFramesRead = f.read_raw()
+            self.assertEqual(nbFramesRead, 1000)
+            self.assertTrue(np.all(raw == native))
+            f.seek(990)
+            raw, nbFramesRead = f.read_raw(20, out=np.full((20, 2), 7, np.uint8))
+            self.assertEqual(nbFramesRead, 10)
+            self.assertTrue(np.all(raw[:10] == native[990:]))
+            self.assertTrue(np.all(raw[10:] == 0))
+            f.set_normalization(False)
+            self.assertTrue(np.all(f.readFromTo(0, 1000, dtype=np.float64)[0] == data >> 8))
+            f.close()
+        finally:
+            os.remove(filename)
+
+
+class TestBatch(unittest.TestCase):
+
+    test_filename = os.path.join(CURR_DIR, "test.wav")
+    missing_filename = os.path.join(CURR_DIR, "missing.wav")
+
+    def test_read_many(self):
+        paths = [self.test_filename, self.missing_filename, self.test_filename]
+        results = list(read_many(paths, dtype=np.int16, max_workers=2))
+        self.assertEqual([r.index for r in results], [0, 1, 2])
+        self.assertTrue(results[1].error is not None)
+        self.assertTrue(results[1].data is None)
+        self.assertTrue(np.all(results[0].data == results[2].data))
+
+        results = list(read_many(paths, frames=100, ordered=False))
+        self.assertEqual(sorted(r.index for r in results), [0, 1, 2])
+
+    def test_read_padded(self):
+        paths = [self.missing_filename, self.test_filename]
+        out, lengths, errors = read_padded(paths, 50000, dtype=np.int16)
+        self.assertEqual(out.shape, (2, 50000, 1))
+        self.assertEqual(list(errors), [0])
+        self.assertEqual(lengths[0], 0)
+        self.assertTrue(np.all(out[1, lengths[1]:] == 0))
+
+        f = SndFile(self.test_filename)
+        data, n_samples = f.read(dtype=np.int16)
+        f.close()
+        self.assertEqual(lengths[1], n_samples)
+        self.assertTrue(np.all(out[1, :n_samples] == data))
+
+
+class TestSeekIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        np.random.seed(0)
+        data = np.random.rand(200000, 2).astype(np.float32) - 0.5
+        self.filenames = []
+        for name, format_ in (("test.flac", FILE_FORMATS.SF_FORMAT_FLAC|FILE_FORMATS.SF_FORMAT_PCM_16),
+                              ("test.ogg", FILE_FORMATS.SF_FORMAT_OGG|FILE_FORMATS.SF_FORMAT_VORBIS)):
+            filename = os.path.join(self.tmp_dir, name)
+            f = SndFile(filename, open_mode=OPEN_MODES.SFM_WRITE, writeSamplerate=44100,
+                        writeFormat=format_)
+            f.write(data)
+            f.close()
+            self.filenames.append(filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read_from_to(self):
+        for filename in self.filenames:
+            f = SndFile(filename)
+            data, n_samples = f.read()
+            f.close()
+
+            f = IndexedSndFile(filename, interval=4096)
+            if filename.endswith(".flac"):
+                # libsndfile seeks FLAC frame accurately by itself
+                self.assertTrue(f.seek_index is None)
+            else:
+                self.assertTrue(len(f.seek_index.checkpoints) > 10)
+            for start, stop in ((150000, 151000), (5000, 25000), (25000, 26000), (30000, 31000),
+                                (40000, 41000), (0, 100), (n_samples - 10, n_samples + 10)):
+                restart = getattr(f, "_splicedStart", None)
+                window, n = f.readFromTo(start, stop)
+                self.assertEqual(n, min(stop, n_samples) - start)
+                self.assertTrue(np.all(window[:n] == data[start:start+n]))
+                if start == 30000 and restart is not None:
+                    # no checkpoint between 26000 and 30000, decoding continues
+                    self.assertEqual(f._splicedStart, restart)
+            f.close()
+
+    def test_position(self):
+        for filename in self.filenames:
+            f = SndFile(filename)
+            data, n_samples = f.read()
+            f.close()
+
+            f = IndexedSndFile(filename, interval=4096)
+            f.readFromTo(1000, 2000)
+            self.assertEqual(f.seek(0, SEEK_MODES.SEEK_CUR), 2000)
+            f.readFromTo(n_samples - 10, n_samples + 10)
+            self.assertEqual(f.read()[1], 0)
+            f.readFromTo(1000, 2000)
+            window, n = f.read(1000)
+            self.assertEqual(n, 1000)
+            self.assertTrue(np.all(window == data[2000:3000]))
+            f.close()
+
+    def test_persistence(self):
+        filename = self.filenames[1]
+        index = get_index(filename, cache_dir=self.tmp_dir)
+        self.assertTrue(os.path.exists(index_filename(filename, self.tmp_dir)))
+        self.assertEqual(get_index(filename, cache_dir=self.tmp_dir).checkpoints,
+                         index.checkpoints)
+        os.utime(filename, (0, 0))
+        self.assertFalse(index.is_valid())
+
+
+class TestWindowSampler(unittest.TestCase):
+
+    test_filename = os.path.join(CURR_DIR, "test.wav")
+
+    def test_next_batch(self):
+        f = SndFile(self.test_filename)
+        data, n_samples = f.read(dtype=np.int16)
+        f.close()
+
+        for max_workers in (None, 2):
+            with WindowSampler([self.test_filename]*3, 4000, 8, dtype=np.int16,
+                               max_open=2, max_workers=max_workers, seed=0) as sampler:
+                for i in range(3):
+                    batch, files, offsets = sampler.next_batch()
+                    self.assertEqual(batch.shape, (8, 4000, 1))
+                    for window, offset in zip(batch, offsets):
+                        self.assertTrue(0 <= offset <= n_samples - 4000)
+                        self.assertTrue(np.all(window == data[offset:offset+4000]))
+                stats = sampler.stats()
+                self.assertEqual(stats["windows"], 24)
+                self.assertTrue(stats["frames_per_second"] > 0)
+
+    def test_too_short(self):
+        self.assertRaises(Exception, WindowSampler, [self.test_filename], 10**6, 8)
+
+
+class TestBlockCache(unittest.TestCase):
+
+    test_filename = os.path.join(CURR_DIR, "test.wav")
+
+    def test_read_from_to(self):
+        f = SndFile(self.test_filename)
+        data, n_samples = f.read(dtype=np.int16)
+        f.close()
+
+        cache = BlockCache(max_bytes=3*1000*2, blocksize=1000)
+        f = SndFile(self.test_filename)
+        g = SndFile(self.test_filename)
+        f.block_cache = g.block_cache = cache
+        window, n = f.readFromTo(1500, 3500, dtype=np.int16)
+        self.assertEqual(cache.stats()["misses"], 3)
+        self.assertTrue(np.all(window == data[1500:3500]))
+        window, n = g.readFromTo(2000, 2100, dtype=np.int16)
+        self.assertEqual(cache.hits, 1)
+        self.assertTrue(np.all(window == data[2000:2100]))
+
+        window, n = g.read(200, dtype=np.int16)
+        self.assertTrue(np.all(window == data[2100:2300]))
+        window, n = f.readFromTo(n_samples - 50, n_samples + 50, dtype=np.int16)
+        self.assertEqual(n, 50)
+        self.assertTrue(np.all(window[:50] == data[-50:]))
+        self.assertTrue(np.all(window[50:] == 0))
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(cache.nbytes, 2*1000*2 + 936*2)
+        self.assertTrue(all(block.base is None for block in cache._blocks.values()))
+        f.close()
+        g.close()
+
+    def test_normalization(self):
+        cache = BlockCache(blocksize=1000)
+        f = SndFile(self.test_filename)
+        g = SndFile(self.test_filename)
+        f.block_cache = g.block_cache = cache
+        expected = g.readFromTo(0, 100, dtype=np.int16)[0]
+        normalized = g.readFromTo(0, 100, dtype=np.float32)[0]
+        f.set_normalization(False)
+        self.assertTrue(np.all(f.readFromTo(0, 100, dtype=np.float32)[0] == expected))
+        self.assertTrue(np.all(g.readFromTo(0, 100, dtype=np.float32)[0] == normalized))
+        f.close()
+        g.close()
+
+
+class TestProbe(unittest.TestCase):
+
+    test_filename = os.path.join(CURR_DIR, "test.wav")
+
+    def test_probe(self):
+        info = probe(self.test_filename)
+        self.assertEqual(info.frames, 39936)
+        self.assertEqual(info.samplerate, 8000)
+        self.assertEqual(info.channels, 1)
+        self.assertEqual(info.format, FILE_FORMATS.SF_FORMAT_WAV | FILE_FORMATS.SF_FORMAT_PCM_16)
+        self.assertTrue(info.title is None)
+        self.assertRaises(SndFileError, probe, os.path.join(CURR_DIR, "tests.py"))
+
+    def test_index_directory(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            shutil.copy(self.test_filename, os.path.join(tmp_dir, "a.wav"))
+            shutil.copy(self.test_filename, os.path.join(tmp_dir, "b.wav"))
+            with open(os.path.join(tmp_dir, "c.wav"), "w") as f:
+                f.write("not audio")
+            index_path = os.path.join(tmp_dir, "index.sqlite")
+
+            result = index_directory(tmp_dir, index_path, workers=2)
+            self.assertEqual((result["probed"], result["errors"]), (3, 1))
+            os.remove(os.path.join(tmp_dir, "b.wav"))
+            result = index_directory(tmp_dir, index_path, workers=2)
+            self.assertEqual((result["probed"], result["skipped"], result["removed"]), (0, 2, 1))
+
+            index = read_index(index_path)
+            self.assertEqual(list(index), [os.path.join(tmp_dir, "a.wav")])
+            self.assertEqual(index[os.path.join(tmp_dir, "a.wav")].frames, 39936)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_unicode_path(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, u"\xe9.wav")
+            try:
+                shutil.copy(self.test_filename, path)
+            except UnicodeEncodeError:
+                raise unittest.SkipTest("the filesystem encoding can't encode %r" % path)
+            self.assertEqual(probe(path).frames, 39936)
+            result = index_directory(tmp_dir, os.path.join(tmp_dir, "index.sqlite"))
+            self.assertEqual((result["probed"], result["errors"]), (1, 0))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_run(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            report = benchmark.run(tmp_dir, ["wav_pcm16", "flac_pcm16"], channels=[2, 16],
+                                   durations=[0.1], dtypes=[np.int16], blocksizes=[512],
+                                   repeat=1)
+        finally:
+            shutil.rmtree(tmp_dir)
+        self.assertEqual(len(report["skipped"]), 1)
+        cases = set((r["case"], r["fixture"], r["channels"]) for r in report["results"])
+        self.assertTrue(("memmap", "wav_pcm16", 16) in cases)
+        self.assertTrue(("readFromTo", "flac_pcm16", 2) in cases)
+        for result in report["results"]:
+            self.assertTrue(result["frames_per_second"] > 0)
+
+    def test_max_read_bytes(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            report = benchmark.run(tmp_dir, ["wav_pcm16"], channels=[2], durations=[0.1],
+                                   dtypes=[np.int16], blocksizes=[512], repeat=1,
+                                   max_read_bytes=1000)
+        finally:
+            shutil.rmtree(tmp_dir)
+        frames = dict((r["case"], r["frames"]) for r in report["results"])
+        self.assertEqual(frames["read"], 250)
+        self.assertEqual(frames["read_many"], 8*125)
+        self.assertEqual(frames["write"], 4800)
+
+
+class TestInstrument(unittest.TestCase):
+
+    test_filename = os.path.join(CURR_DIR, "test.wav")
+
+    def tearDown(self):
+        instrument.disable()
+        instrument.reset()
+
+    def test_snapshot(self):
+        events = []
+        instrument.enable()
+        instrument.subscribe(events.append)
+        f = SndFile(self.test_filename)
+        f.readFromTo(100, 1100, dtype=np.int16)
+        f.close()
+        instrument.unsubscribe(events.append)
+        instrument.disable()
+
+        f = SndFile(self.test_filename)
+        f.read()
+        f.close()
+
+        metrics = dict((m["function"], m) for m in instrument.snapshot())
+        self.assertEqual(sorted(metrics), ["sf_close", "sf_open", "sf_read_short", "sf_seek"])
+        read = metrics["sf_read_short"]
+        self.assertEqual((read["format"], read["dtype"]), ("WAV/PCM_16", "int16"))
+        self.assertEqual((read["calls"], read["frames"], read["bytes"]), (1, 1000, 2000))
+        self.assertEqual(sum(read["histogram"]), 1)
+        self.assertEqual([event.function for event in events],
+                         ["sf_open", "sf_seek", "sf_read_short", "sf_close"])
+
+
+class TestPrefetchReader(unittest.TestCase):
+
+    test_filename = os.path.join(CURR_DIR, "test.wav")
+
+    def test_blocks(self):
+        with SndFile(self.test_filename) as f:
+            expected = f.read(dtype=np.int16)[0]
+            f.seek(0)
+            with PrefetchReader(f, 1000, depth=3, dtype=np.int16) as reader:
+                blocks = [block.copy() for block in reader]
+                stats = reader.stats()
+        self.assertEqual(len(blocks), -(-len(expected)//1000))
+        self.assertTrue(np.array_equal(np.concatenate(blocks), expected))
+        self.assertEqual((stats["blocks"], stats["frames"]), (len(blocks), len(expected)))
+
+    def test_close_early(self):
+        with SndFile(self.test_filename) as f:
+            reader = PrefetchReader(f, 100, depth=2, dtype="native")
+            block = reader.next_block()
+            self.assertEqual(block.shape, (100, f.channels))
+            self.assertEqual(block.dtype, np.int16)
+            reader.close()
+            self.assertFalse(reader._thread.is_alive())
+            self.assertTrue(reader.next_block() is None)
+
+
+class TestStreamWriter(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_coalesce(self):
+        data = (np.arange(20000) % 2000 - 1000).astype(np.int16).reshape(-1, 2)
+        f = SndFile(self.filename, open_mode=OPEN_MODES.SFM_WRITE, writeNbChannels=2)
+        writer = StreamWriter(f, buffer_frames=1024, dtype=np.int16)
+        for start in range(0, len(data), 50):
+            # int32 frames are cast into the int16 staging buffer
+            writer.write(data[start:start + 50].astype(np.int32))
+        writer.close()
+        f.close()
+        self.assertEqual(writer.stats()["flushes"], 10)
+        f = SndFile(self.filename)
+        self.assertTrue(np.all(f.read(dtype=np.int16)[0] == data))
+        f.close()
+
+    def test_mixed_kinds(self):
+        data = (np.arange(6000) % 4000 - 2000).astype(np.int16).reshape(-1, 2)
+        f = SndFile(self.filename, open_mode=OPEN_MODES.SFM_WRITE, writeNbChannels=2)
+        # int16 and float frames given to the default float32 buffer
+        writer = StreamWriter(f, buffer_frames=1024)
+        writer.write(data[:1000])
+        writer.write(data[1000:2000]/32768.)
+        writer.write(data[2000:])
+        writer.close()
+        f.close()
+        f = SndFile(self.filename)
+        self.assertTrue(np.all(f.read(dtype=np.int16)[0] == data))
+        f.close()
+
+    def test_sync(self):
+        data = np.zeros((1000, 1), np.int16)
+        f = SndFile(self.filename, open_mode=OPEN_MODES.SFM_WRITE, writeNbChannels=1)
+        writer = StreamWriter(f, buffer_frames=100, dtype=np.int16, sync_interval=0)
+        writer.write(data)
+        g = SndFile(self.filename)
+        self.assertEqual(g.nbFrames, 1000)
+        g.close()
+        writer.close()
+        f.close()
+
+    def test_write_non_contiguous(self):
+        data = np.arange(8000, dtype=np.int16).reshape(-1, 4)
+        f = SndFile(self.filename, open_mode=OPEN_MODES.SFM_WRITE, writeNbChannels=2)
+        self.assertEqual(f.write(data[:, ::2])[1], 4000)
+        f.close()
+        f = SndFile(self.filename)
+        self.assertTrue(np.all(f.read(dtype=np.int16)[0] == data[:, ::2]))
+        f.close()
+
+
+class TestTranscode(unittest.TestCase):
+
+    test_filename = os.path.join(CURR_DIR, "test.wav")
+
+    def test_transcode(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            src = os.path.join(tmp_dir, "src.wav")
+            shutil.copy(self.test_filename, src)
+            broken = os.path.join(tmp_dir, "broken.wav")
+            with open(broken, "w") as f:
+                f.write("not audio")
+            dst_dir = os.path.join(tmp_dir, "flac")
+
+            results = transcode([src, broken], dst_dir, "flac", workers=2)
+            statuses = dict((os.path.basename(r.src), r.status) for r in results)
+            self.assertEqual(statuses, {"src.wav": "done", "broken.wav": "error"})
+            self.assertEqual(sorted(os.listdir(dst_dir)), ["src.flac"])
+            with SndFile(self.test_filename) as f:
+                expected = f.read(dtype=np.int16)[0]
+            with SndFile(os.path.join(dst_dir, "src.flac")) as f:
+                self.assertEqual(f.format, FILE_FORMATS.SF_FORMAT_FLAC|FILE_FORMATS.SF_FORMAT_PCM_16)
+                self.assertTrue(np.all(f.read(dtype=np.int16)[0] == expected))
+
+            results = transcode([src], dst_dir, "flac", workers=2)
+            self.assertEqual([r.status for r in results], ["skipped"])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_same_basename(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for directory in ("a", "b"):
+                os.mkdir(os.path.join(tmp_dir, directory))
+                shutil.copy(self.test_filename, os.path.join(tmp_dir, directory, "x.wav"))
+            srcs = [os.path.join(tmp_dir, "a", "x.wav"), os.path.join(tmp_dir, "b", "x.wav")]
+            dst_dir = os.path.join(tmp_dir, "flac")
+            results = transcode(srcs, dst_dir, "flac", workers=2)
+            statuses = dict((r.src, r.status) for r in results)
+            self.assertEqual(statuses, {srcs[0]: "done", srcs[1]: "error"})
+            self.assertEqual(os.listdir(dst_dir), ["x.flac"])
+
+            results = transcode(srcs, os.path.join(tmp_dir, "tree"), "flac", root=tmp_dir)
+            self.assertEqual([r.status for r in results], ["done", "done"])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_rejected_format(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            results = transcode([self.test_filename], tmp_dir, "flac", "float", workers=1)
+            self.assertEqual([r.status for r in results], ["error"])
+            self.assertEqual(os.listdir(tmp_dir), [])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class TestOverview(unittest.TestCase):
+
+    test_filename = os.path.join(CURR_DIR, "test.wav")
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_levels(self):
+        overview = build_overview(self.test_filename, levels=(16, 64), cache_dir=self.tmp_dir)
+        with SndFile(self.test_filename) as f:
+            data = f.read()[0]
+        self.assertEqual(overview.factors, (16, 64))
+        for factor, level in zip(overview.factors, overview.levels):
+            self.assertEqual(level.shape, (-(-len(data)//factor), 3, 1))
+            for bucket in (0, 7, len(level) - 1):
+                frames = data[bucket*factor:(bucket + 1)*factor]
+                self.assertTrue(np.allclose(level[bucket, 0], frames.min(axis=0)))
+                self.assertTrue(np.allclose(level[bucket, 1], frames.max(axis=0)))
+                self.assertTrue(np.allclose(level[bucket, 2], np.sqrt((frames**2).mean(axis=0))))
+
+    def test_get_overview(self):
+        mins, maxs, rms = get_overview(self.test_filename, 0, 6400, 100,
+                                       cache_dir=self.tmp_dir, levels=(16, 64))
+        self.assertTrue(os.path.exists(overview_filename(self.test_filename, self.tmp_dir)))
+        with SndFile(self.test_filename) as f:
+            data = f.readFromTo(0, 6400)[0].reshape(100, 64)
+        self.assertTrue(np.allclose(mins[:, 0], data.min(axis=1)))
+        self.assertTrue(np.allclose(maxs[:, 0], data.max(axis=1)))
+        self.assertTrue(np.allclose(rms[:, 0], np.sqrt((data**2).mean(axis=1))))
+
+
+class TestSndFileSet(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data = (np.arange(20000, dtype=np.int16)).reshape(-1, 2)
+        self.paths = []
+        for i, (start, stop) in enumerate([(0, 3000), (3000, 3000), (3000, 10000)]):
+            path = os.path.join(self.tmp_dir, "%d.wav" % i)
+            f = SndFile(path, open_mode=OPEN_MODES.SFM_WRITE, writeNbChannels=2)
+            f.write(self.data[start:stop])
+            f.close()
+            self.paths.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read_across_files(self):
+        with SndFileSet(self.paths, max_open=1) as files:
+            self.assertEqual(files.nbFrames, 10000)
+            self.assertEqual(files.locate(3000), (2, 0))
+            data, nbFramesRead = files.readFromTo(2500, 3500, dtype=np.int16)
+            self.assertEqual(nbFramesRead, 1000)
+            self.assertTrue(np.all(data == self.data[2500:3500]))
+            data, nbFramesRead = files.readFromTo(9900, 10100, dtype=np.int16)
+            self.assertEqual(nbFramesRead, 100)
+            self.assertTrue(np.all(data[100:] == 0))
+
+    def test_seek_read(self):
+        with SndFileSet(self.paths) as files:
+            files.seek(-5000, SEEK_MODES.SEEK_END)
+            data, nbFramesRead = files.read(dtype=np.int16, channels=[1])
+            self.assertEqual(nbFramesRead, 5000)
+            self.assertTrue(np.all(data == self.data[5000:, 1:]))
+            self.assertEqual(files.seek(0, SEEK_MODES.SEEK_CUR), 10000)
+            data = files.readFromTo(2900, 3100, dtype="native")[0]
+            self.assertEqual(data.dtype, np.int16)
+            self.assertTrue(np.all(data == self.data[2900:3100]))
+
+
+class TestResample(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_dir, "tone.wav")
+        t = np.arange(44100)/44100.
+        self.data = np.empty((44100, 2), np.float32)
+        self.data[:, 0] = 0.5*np.sin(2*np.pi*440*t)
+        self.data[:, 1] = 0.5*np.sin(2*np.pi*12000*t)
+        f = SndFile(self.filename, open_mode=OPEN_MODES.SFM_WRITE, writeSamplerate=44100,
+                    writeFormat=FILE_FORMATS.SF_FORMAT_WAV|FILE_FORMATS.SF_FORMAT_FLOAT)
+        f.write(self.data)
+        f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_resampler_blocks(self):
+        resampler = Resampler(44100, 16000, 2)
+        whole = np.concatenate((resampler.process(self.data), resampler.flush()))
+        self.assertEqual(len(whole), 16000)
+        resampler.reset()
+        parts = [resampler.process(self.data[i:i + 1001]) for i in range(0, 44100, 1001)]
+        self.assertTrue(np.all(np.concatenate(parts + [resampler.flush()]) == whole))
+        t = np.arange(16000)/16000.
+        self.assertTrue(np.allclose(whole[100:-100, 0], 0.5*np.sin(2*np.pi*440*t[100:-100]),
+                                    atol=1e-4))
+        # above the new Nyquist frequency
+        self.assertTrue(np.abs(whole[100:-100, 1]).max() < 1e-3)
+
+    def test_normalized_sndfile(self):
+        with SndFile(self.filename) as f:
+            normalized = NormalizedSndFile(f, 16000, channels=1, dtype=np.int16)
+            self.assertEqual(normalized.nbFrames, 16000)
+            blocks = [block.copy() for block in normalized.blocks(3000)]
+        self.assertEqual([len(block) for block in blocks], [3000]*5 + [1000])
+        data = np.concatenate(blocks)
+        self.assertEqual(data.dtype, np.int16)
+        t = np.arange(16000)/16000.
+        expected = 0.25*np.sin(2*np.pi*440*t)*32768
+        self.assertTrue(np.abs(data[100:-100, 0] - expected[100:-100]).max() < 40)
+
+        filename = os.path.join(self.tmp_dir, "normalized.wav")
+        self.assertEqual(normalize_file(self.filename, filename), 16000)
+        with SndFile(filename) as f:
+            self.assertEqual((f.samplerate, f.channels, f.nbFrames), (16000, 1, 16000))
+            self.assertTrue(np.allclose(f.read(dtype=np.float32)[0][:, 0]*32768, data[:, 0],
+                                        atol=1))
+
 
 if __name__=="__main__":
     with SndFile("LS100673.WAV") as f:
         #print various information
-        print f
+        print(f)
         #read from 1 to 3 seconds
         data, nbFramesRead = f.readFromTo(1*f.samplerate, 3*f.samplerate, dtype=np.float64)
-        print "nb frames read:",nbFramesRead
+        print("nb frames read:", nbFramesRead)
 
         #get the left channel
         lChannel = data[:,0]
@@ -0,0 +1,229 @@
+"""
+Batch transcoding of audio files on a process pool.
+
+Every file is streamed block by block from a SndFile into a SndFile opened
+for writing in the destination format, the files being spread over one
+process per cpu (encoding is CPU bound):
+
+    python -m ctsndfile.transcode -f flac -s pcm_24 -o /archive/flac /archive/wav/*.wav
+
+Outputs are written to a temporary name then renamed, so an interrupted run
+never leaves a truncated file behind and can be resumed: the outputs that
+already exist are skipped.
+"""
+
+import argparse
+import os
+import sys
+import time
+from collections import namedtuple
+from multiprocessing import Pool
+
+import numpy as np
+
+from ctsndfile.libsndfile import _string_types, SndFile, SndFileError, OPEN_MODES, FILE_FORMATS
+
+# file extension of the major formats, the lowercase name of the format else
+EXTENSIONS = {
+    FILE_FORMATS.SF_FORMAT_MAT4: "mat",
+    FILE_FORMATS.SF_FORMAT_MAT5: "mat",
+    FILE_FORMATS.SF_FORMAT_WAVEX: "wav",
+}
+
+_PCM = (FILE_FORMATS.SF_FORMAT_PCM_S8, FILE_FORMATS.SF_FORMAT_PCM_16,
+        FILE_FORMATS.SF_FORMAT_PCM_24, FILE_FORMATS.SF_FORMAT_PCM_32,
+        FILE_FORMATS.SF_FORMAT_PCM_U8)
+
+TranscodeResult = namedtuple("TranscodeResult", ["src", "dst", "status", "frames",
+                                                 "samplerate", "seconds", "error"])
+
+
+def format_value(name, major):
+    """ returns the FILE_FORMATS value of a format name such as "flac" or
+    "SF_FORMAT_FLAC" (or of a subtype name such as "pcm_24" if major is
+    False), values are returned as is """
+    if not isinstance(name, _string_types):
+        return name
+    name = name.upper()
+    if not name.startswith("SF_FORMAT_"):
+        name = "SF_FORMAT_" + name
+    value = getattr(FILE_FORMATS, name, None)
+    if value is None or bool(value & FILE_FORMATS.SF_FORMAT_TYPEMASK) != major:
+        raise ValueError("unknown %s %s" % ("format" if major else "subtype", name))
+    return value
+
+
+def extension(format_):
+    """ returns the file extension of the major format format_ """
+    major = format_ & FILE_FORMATS.SF_FORMAT_TYPEMASK
+    if major in EXTENSIONS:
+        return EXTENSIONS[major]
+    for name, value in vars(FILE_FORMATS).items():
+        if value == major and name.startswith("SF_FORMAT_"):
+            return name[len("SF_FORMAT_"):].lower()
+    raise ValueError("unknown format 0x%x" % format_)
+
+
+def output_path(src, dst_dir, format_, root=None):
+    """ returns the path in dst_dir of the transcoding of src, keeping the
+    directories of src under root if given """
+    if root is None:
+        name = os.path.basename(src)
+    else:
+        name = os.path.relpath(src, root)
+    return os.path.join(dst_dir, os.path.splitext(name)[0] + "." + extension(format_))
+
+
+def transcode_file(src, dst, format_, subtype=None, blocksize=1 << 16):
+    """ transcodes src into dst in the major format format_ with subtype (by
+    default the subtype of src), writing to dst + ".part" then renaming it.
+    Returns the number of frames transcoded and their samplerate. """
+    source = SndFile(src)
+    try:
+        if subtype is None:
+            subtype = source.format & FILE_FORMATS.SF_FORMAT_SUBMASK
+        # integers keep PCM exact, floats avoid rescaling anything else
+        if source.format & FILE_FORMATS.SF_FORMAT_SUBMASK in _PCM and subtype in _PCM:
+            dtype = np.int32
+        else:
+            dtype = np.float64
+        tmp = dst + ".part"
+        destination = None
+        try:
+            destination = SndFile(tmp, OPEN_MODES.SFM_WRITE,
+                                  writeSamplerate=source.samplerate,
+                                  writeFormat=format_|subtype,
+                                  writeNbChannels=source.channels)
+            nbFrames = 0
+            for block in source.blocks(blocksize, dtype=dtype):
+                if destination.write(block)[1] != block.size:
+                    raise SndFileError("can't write %s" % tmp)
+                nbFrames += len(block)
+            destination.close()
+        except:
+            if destination is not None:
+                destination.close()
+            # libsndfile may have created it before rejecting the format
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        os.rename(tmp, dst)
+        return nbFrames, source.samplerate
+    finally:
+        source.close()
+
+
+def _transcode_job(job):
+    """ runs a job of transcode in a worker process """
+    src, dst, format_, subtype, blocksize = job
+    start = time.time()
+    try:
+        nbFrames, samplerate = transcode_file(src, dst, format_, subtype, blocksize)
+    except Exception as e:
+        return TranscodeResult(src, dst, "error", 0, 0, time.time() - start, str(e))
+    return TranscodeResult(src, dst, "done", nbFrames, samplerate, time.time() - start, None)
+
+
+def transcode(src_paths, dst_dir, format, subtype=None, workers=None, root=None,
+              overwrite=False, blocksize=1 << 16, progress=None):
+    """ transcodes the files src_paths into dst_dir in the major format
+    format with subtype (FILE_FORMATS values or names such as "flac" and
+    "pcm_16", the subtype of each source by default) on workers processes
+    (one per cpu by default). Outputs are named after their source with the
+    extension of format, keeping the directories under root if given (the
+    sources sharing an output with a previous one give an "error" result).
+    Existing outputs are skipped unless overwrite is True.
+    progress, if given, is called with each TranscodeResult, the number of
+    files finished and the number of files. Returns the TranscodeResults,
+    in the order the files finished. A file that fails gives an "error"
+    result and doesn't stop the others. """
+    format_ = format_value(format, True)
+    if subtype is not None:
+        subtype = format_value(subtype, False)
+    jobs = []
+    results = []
+    # the source of each output, two jobs must never write the same file
+    sources = {}
+    for src in src_paths:
+        dst = output_path(src, dst_dir, format_, root)
+        if dst in sources:
+            results.append(TranscodeResult(src, dst, "error", 0, 0, 0.,
+                                           "%s is also the output of %s" % (dst, sources[dst])))
+            continue
+        sources[dst] = src
+        if not overwrite and os.path.exists(dst):
+            results.append(TranscodeResult(src, dst, "skipped", 0, 0, 0., None))
+        else:
+            jobs.append((src, dst, format_, subtype, blocksize))
+    total = len(results) + len(jobs)
+    if progress is not None:
+        for i, result in enumerate(results):
+            progress(result, i + 1, total)
+
+    for directory in set(os.path.dirname(job[1]) for job in jobs):
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+    if not jobs:
+        return results
+    pool = Pool(workers)
+    try:
+        for result in pool.imap_unordered(_transcode_job, jobs):
+            results.append(result)
+            if progress is not None:
+                progress(result, len(results), total)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return results
+
+
+class _Progress(object):
+    """ class internal, progress callback of the command line """
+
+    def __init__(self, out):
+        self.out = out
+        self.start = time.time()
+        self.audio_seconds = 0.
+
+    def __call__(self, result, done, total):
+        if result.status == "done" and result.samplerate:
+            self.audio_seconds += float(result.frames)/result.samplerate
+        elapsed = time.time() - self.start
+        line = "[%d/%d] %s %s" % (done, total, result.status, result.src)
+        if result.status == "error":
+            line += ": %s" % result.error
+        elif result.status == "done":
+            line += " (%.2fs)" % result.seconds
+        self.out.write("%s, %.1fx realtime\n" % (line, self.audio_seconds/elapsed if elapsed else 0.))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("paths", nargs="+", help="files to transcode")
+    parser.add_argument("-o", "--output-dir", required=True)
+    parser.add_argument("-f", "--format", required=True, help="wav, flac, ogg...")
+    parser.add_argument("-s", "--subtype", default=None,
+                        help="pcm_16, pcm_24, vorbis... (that of each source by default)")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="processes (one per cpu by default)")
+    parser.add_argument("--root", default=None,
+                        help="keep the directories of the paths under root in the output")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="transcode again the outputs that already exist")
+    args = parser.parse_args(argv)
+
+    progress = _Progress(sys.stderr)
+    results = transcode(args.paths, args.output_dir, args.format, args.subtype,
+                        args.workers, args.root, args.overwrite, progress=progress)
+    counts = dict((status, sum(1 for result in results if result.status == status))
+                  for status in ("done", "skipped", "error"))
+    elapsed = time.time() - progress.start
+    sys.stderr.write("%(done)d transcoded, %(skipped)d skipped, %(error)d errors" % counts
+                     + " in %.1fs, %.1fx realtime\n"
+                     % (elapsed, progress.audio_seconds/elapsed if elapsed else 0.))
+    return 1 if counts["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
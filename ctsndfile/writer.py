@@ -0,0 +1,164 @@
+"""
+Buffered writing for producers making many small writes.
+
+A StreamWriter coalesces the frames it's given in a staging buffer and
+writes them to libsndfile in large blocks. It can keep the header of the file
+up to date and fsync it periodically, so a long recording that crashes is
+still readable up to the last sync, without paying for a sync per write:
+
+    f = SndFile("take.wav", OPEN_MODES.SFM_WRITE, writeNbChannels=2)
+    with StreamWriter(f, sync_interval=5.) as writer:
+        for frames in microphone():
+            writer.write(frames)
+    f.close()
+"""
+
+import time
+
+import numpy as np
+
+from ctsndfile.libsndfile import data_types_match
+
+
+class StreamWriter(object):
+    """ writes the frames given to write to sndfile, opened for writing,
+    through a staging buffer of buffer_frames frames of dtype (one of
+    data_types_match) allocated once. Frames of another dtype of the same
+    kind, or not C-contiguous, are cast into the staging buffer piece by
+    piece, frames of dtype written while the buffer is empty and at least
+    buffer_frames long are written directly. Integer frames given to a float
+    buffer (or float frames to an integer one) flush it and reallocate it in
+    their dtype, so libsndfile scales them as SndFile.write does.
+    The staging buffer is flushed when full, and also by write when it holds
+    frames older than flush_interval seconds if given, to bound the latency.
+    Every sync_interval seconds (if given) a flush is followed by a header
+    update and an fsync. If header_auto is True libsndfile also rewrites the
+    header after every flush. close flushes and syncs but leaves sndfile
+    open. """
+
+    def __init__(self, sndfile, buffer_frames=1 << 14, dtype=np.float32,
+                 flush_interval=None, sync_interval=None, header_auto=False):
+        dtype = np.dtype(dtype).type
+        if dtype not in data_types_match:
+            raise TypeError("unsupported dtype %s" % np.dtype(dtype))
+        if buffer_frames <= 0:
+            raise Exception("Please choose buffer_frames > 0")
+        self.sndfile = sndfile
+        self.flush_interval = flush_interval
+        self.sync_interval = sync_interval
+        self._buffer = np.empty((buffer_frames, sndfile.channels), dtype)
+        self._staged = 0
+        self._staged_since = None
+        self._last_sync = time.time()
+        self._closed = False
+        if header_auto:
+            sndfile.update_header(auto=True)
+        self.reset_stats()
+
+    @property
+    def buffer_frames(self):
+        return len(self._buffer)
+
+    def write(self, frames):
+        """ stages frames, an array of shape (nbFrames, nbChannels) (or
+        (nbFrames,) for mono files), flushing as needed """
+        if self._closed:
+            raise Exception("I/O operation on a closed StreamWriter")
+        frames = np.asarray(frames)
+        channels = self._buffer.shape[1]
+        if frames.ndim == 1 and channels == 1:
+            frames = frames[:, None]
+        if frames.ndim != 2 or frames.shape[1] != channels:
+            raise Exception("frames must be of shape (nbFrames, %d)" % channels)
+        if frames.dtype.kind != self._buffer.dtype.kind:
+            self._restage(frames.dtype)
+        self._writes += 1
+        self._frames += len(frames)
+
+        if (self._staged == 0 and len(frames) >= len(self._buffer)
+                and frames.dtype == self._buffer.dtype and frames.flags.c_contiguous):
+            self._write(frames)
+        else:
+            position = 0
+            while position < len(frames):
+                if self._staged == 0:
+                    self._staged_since = time.time()
+                nbFrames = min(len(frames) - position, len(self._buffer) - self._staged)
+                self._buffer[self._staged:self._staged + nbFrames] = frames[position:position + nbFrames]
+                self._staged += nbFrames
+                position += nbFrames
+                if self._staged == len(self._buffer):
+                    self.flush()
+
+        now = time.time()
+        if self.sync_interval is not None and now - self._last_sync >= self.sync_interval:
+            self.sync()
+        elif (self._staged and self.flush_interval is not None
+                and now - self._staged_since >= self.flush_interval):
+            self.flush()
+
+    def _restage(self, dtype):
+        """ class internal, flushes and reallocates the staging buffer in
+        dtype, casting between integers and floats would drop their scale """
+        if dtype.type not in data_types_match:
+            raise TypeError("unsupported dtype %s" % dtype)
+        self.flush()
+        self._buffer = np.empty(self._buffer.shape, dtype)
+
+    def _write(self, frames):
+        """ class internal, writes frames to sndfile """
+        start = time.time()
+        nbWritten = self.sndfile.write(frames)[1]
+        self._write_seconds += time.time() - start
+        self._flushes += 1
+        if nbWritten != frames.size:
+            raise Exception("wrote %d of %d samples" % (nbWritten, frames.size))
+
+    def flush(self):
+        """ writes the staged frames to sndfile """
+        if self._staged:
+            staged = self._staged
+            self._staged = 0
+            self._write(self._buffer[:staged])
+
+    def sync(self):
+        """ flushes, updates the header and fsyncs the file """
+        self.flush()
+        start = time.time()
+        self.sndfile.update_header()
+        self.sndfile.write_sync()
+        self._last_sync = time.time()
+        self._sync_seconds += self._last_sync - start
+        self._syncs += 1
+
+    def stats(self):
+        """ returns the number of writes and frames given, of flushes and
+        syncs made and the time spent in them, and the frames staged """
+        return {"writes": self._writes,
+                "frames": self._frames,
+                "flushes": self._flushes,
+                "write_seconds": self._write_seconds,
+                "syncs": self._syncs,
+                "sync_seconds": self._sync_seconds,
+                "staged": self._staged}
+
+    def reset_stats(self):
+        self._writes = 0
+        self._frames = 0
+        self._flushes = 0
+        self._write_seconds = 0.
+        self._syncs = 0
+        self._sync_seconds = 0.
+
+    def close(self):
+        """ flushes and syncs, sndfile is left open """
+        if self._closed:
+            return
+        self.sync()
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()